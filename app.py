@@ -1,159 +1,154 @@
+import asyncio
 import traceback
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict, Any
-import ollama
-from rag_core import get_retriever, to_retrieved_chunks, build_context_block, rerank
 from settings import LLM_MODEL, TOP_K
-from agent.agent_main import build_agent
-from repo_ingest import main as ingest_repo
-from dev_workflow import (
-    make_plan,
-    make_plan_files,
-    apply_plan,
-    apply_plan_files,
-    revert_commit,
-    get_plan_hunks,
-    apply_plan_hunks,
-    implement_plan,
-    verify_plan,
-)
-from orchestrator import sandbox_test_plan, create_plan, get_plan
-from implementer import PatchValidationError
-
-app = FastAPI(title="Repo Doc Chat + Dev Agent", version="0.5.0")
+
+# Heavy modules (embeddings, git, LLM client, agent) are imported inside the
+# handlers that use them so uvicorn workers boot without pulling them in.
+
+app = FastAPI(title="Repo Doc Chat + Dev Agent", version="0.5.0", default_response_class=ORJSONResponse)
 _agent = None
 
 
-class ChatRequest(BaseModel):
+class _RequestModel(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+
+class ChatRequest(_RequestModel):
     question: str
     history: Optional[List[List[str]]] = None
     filters: Optional[Dict[str, Any]] = None
     top_k: Optional[int] = TOP_K
 
 @app.post("/repo/ingest")
-def repo_ingest():
-    ingest_repo()
-    return {"status":"ok"}
+async def repo_ingest():
+    from repo_ingest import main as ingest_repo
+    await asyncio.to_thread(ingest_repo)
+    return ORJSONResponse({"status":"ok"})
 
-class PlanReq(BaseModel):
+class PlanReq(_RequestModel):
     request: str
 
 
 @app.post("/dev/plan")
-def dev_plan(req: PlanReq):
-    res = make_plan(req.request)
-    return JSONResponse(res)
+async def dev_plan(req: PlanReq):
+    from dev_workflow import make_plan
+    return ORJSONResponse(await asyncio.to_thread(make_plan, req.request))
 
 
-class ImplementReq(BaseModel):
+class ImplementReq(_RequestModel):
     plan_id: str
     feedback: Optional[str] = None
 
 
 @app.post("/dev/implement")
-def dev_implement(req: ImplementReq):
+async def dev_implement(req: ImplementReq):
+    from dev_workflow import implement_plan
+    from implementer import PatchValidationError
     try:
-        res = implement_plan(req.plan_id, feedback=req.feedback)
-        return JSONResponse(res)
+        return ORJSONResponse(await asyncio.to_thread(implement_plan, req.plan_id, feedback=req.feedback))
     except PatchValidationError as exc:
-        return JSONResponse({"error": str(exc)}, status_code=400)
+        return ORJSONResponse({"error": str(exc)}, status_code=400)
 
 
-class SandboxReq(BaseModel):
+class SandboxReq(_RequestModel):
     plan_id: str
 
 @app.post("/dev/sandbox_test")
-def dev_sandbox_test(req: SandboxReq):
+async def dev_sandbox_test(req: SandboxReq):
+    from orchestrator import sandbox_test_plan
     try:
-        res = sandbox_test_plan(req.plan_id)
-        return JSONResponse(res)
+        return ORJSONResponse(await asyncio.to_thread(sandbox_test_plan, req.plan_id))
     except Exception as e:
         tb = traceback.format_exc()
-        return JSONResponse({"error": str(e), "traceback": tb}, status_code=400)
+        return ORJSONResponse({"error": str(e), "traceback": tb}, status_code=400)
 
-class PlanPreviewReq(BaseModel):
+class PlanPreviewReq(_RequestModel):
     request: str
 
 @app.post("/dev/plan/preview")
-def dev_plan_preview(req: PlanPreviewReq):
-    res = create_plan(req.request)
+async def dev_plan_preview(req: PlanPreviewReq):
+    from orchestrator import create_plan
+    res = await asyncio.to_thread(create_plan, req.request)
     # dönen res içinde plan_id, plan, patch_preview, patch var
     # biz sadece preview dönebiliriz:
-    return JSONResponse({"plan_id": res["plan_id"], "plan": res["plan"], "patch_preview": res["patch_preview"]})
+    return ORJSONResponse({"plan_id": res["plan_id"], "plan": res["plan"], "patch_preview": res["patch_preview"]})
 
 
-class FilesReq(BaseModel):
+class FilesReq(_RequestModel):
     plan_id: str
 
 @app.post("/dev/plan/files")
-def dev_plan_files(req: FilesReq):
-    res = make_plan_files(req.plan_id)
-    return JSONResponse(res)
+async def dev_plan_files(req: FilesReq):
+    from dev_workflow import make_plan_files
+    return ORJSONResponse(await asyncio.to_thread(make_plan_files, req.plan_id))
 
-class HunkReq(BaseModel):
+class HunkReq(_RequestModel):
     plan_id: str
 
 @app.post("/dev/plan/hunks")
-def dev_plan_hunks(req: HunkReq):
-    res = get_plan_hunks(req.plan_id)
-    return JSONResponse(res)
+async def dev_plan_hunks(req: HunkReq):
+    from dev_workflow import get_plan_hunks
+    return ORJSONResponse(await asyncio.to_thread(get_plan_hunks, req.plan_id))
 
-class ApplyHunksReq(BaseModel):
+class ApplyHunksReq(_RequestModel):
     plan_id: str
     selections: Dict[str, List[int]]
 
 @app.post("/dev/apply/hunks")
-def dev_apply_hunks(req: ApplyHunksReq):
-    res = apply_plan_hunks(req.plan_id, req.selections)
-    return JSONResponse(res)
+async def dev_apply_hunks(req: ApplyHunksReq):
+    from dev_workflow import apply_plan_hunks
+    return ORJSONResponse(await asyncio.to_thread(apply_plan_hunks, req.plan_id, req.selections))
 
-class ApplyReq(BaseModel):
+class ApplyReq(_RequestModel):
     plan_id: str
 
 @app.post("/dev/apply")
-def dev_apply(req: ApplyReq):
-    res = apply_plan(req.plan_id)
-    return JSONResponse(res)
+async def dev_apply(req: ApplyReq):
+    from dev_workflow import apply_plan
+    return ORJSONResponse(await asyncio.to_thread(apply_plan, req.plan_id))
 
 
-class VerifyReq(BaseModel):
+class VerifyReq(_RequestModel):
     plan_id: str
     auto_fix: Optional[bool] = True
     max_rounds: Optional[int] = 3
 
 
 @app.post("/dev/verify")
-def dev_verify(req: VerifyReq):
-    res = verify_plan(req.plan_id, auto_fix=req.auto_fix, max_rounds=req.max_rounds)
-    return JSONResponse(res)
+async def dev_verify(req: VerifyReq):
+    from dev_workflow import verify_plan
+    return ORJSONResponse(await asyncio.to_thread(verify_plan, req.plan_id, auto_fix=req.auto_fix, max_rounds=req.max_rounds))
 
-class ApplyFilesReq(BaseModel):
+class ApplyFilesReq(_RequestModel):
     plan_id: str
     files: List[str]
 
 @app.post("/dev/apply/files")
-def dev_apply_files(req: ApplyFilesReq):
-    res = apply_plan_files(req.plan_id, req.files)
-    return JSONResponse(res)
+async def dev_apply_files(req: ApplyFilesReq):
+    from dev_workflow import apply_plan_files
+    return ORJSONResponse(await asyncio.to_thread(apply_plan_files, req.plan_id, req.files))
 
-class RevertReq(BaseModel):
+class RevertReq(_RequestModel):
     commit: str
 
 @app.post("/dev/revert")
-def dev_revert(req: RevertReq):
-    res = revert_commit(req.commit)
-    return JSONResponse(res)
+async def dev_revert(req: RevertReq):
+    from dev_workflow import revert_commit
+    return ORJSONResponse(await asyncio.to_thread(revert_commit, req.commit))
 
-class AgentRequest(BaseModel):
+class AgentRequest(_RequestModel):
     input: str
 
 @app.post("/agent")
-def run_agent(req: AgentRequest):
+async def run_agent(req: AgentRequest):
     global _agent
     if _agent is None:
+        from agent.agent_main import build_agent
         _agent = build_agent()
-    result = _agent.invoke({"input": req.input})
+    result = await asyncio.to_thread(_agent.invoke, {"input": req.input})
     out = result.get("output", "") or result.get("answer","")
-    return JSONResponse({"answer": out, "model": LLM_MODEL})
+    return ORJSONResponse({"answer": out, "model": LLM_MODEL})
@@ -1,19 +1,28 @@
 from __future__ import annotations
 
-import json
+import codecs
+import functools
+import hashlib
+import io
+import os
+import queue
+import re
 import shlex
+import signal
 import subprocess
+import threading
+import time
 import uuid
-from datetime import datetime
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import IO, TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple, Union
 
-from git import Actor, Repo
-from unidiff import PatchSet
+import orjson
 
-from implementer import Implementer, PatchValidationError
-from planner import Planner
 from settings import (
+    CHROMA_DIR,
+    DATA_DIR,
     GIT_COMMIT_AUTHOR,
     GIT_COMMIT_MESSAGE,
     MEMORY_DIR,
@@ -21,8 +30,29 @@ from settings import (
     TEST_CMD,
 )
 
+# git, unidiff and the LLM pipeline (planner pulls in the whole RAG stack) are imported
+# on first use, so light entry points such as make_plan_files stay cheap to import.
+if TYPE_CHECKING:
+    from git import Actor, Repo
+    from unidiff import PatchSet
+
+    from implementer import Implementer
+    from planner import Planner
+
 PLANS_DIR = MEMORY_DIR / "plans"
 PLANS_DIR.mkdir(parents=True, exist_ok=True)
+IMPL_CACHE_DIR = MEMORY_DIR / "impl_cache"
+IMPL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+PLAN_CACHE_DIR = MEMORY_DIR / "plan_cache"
+PLAN_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# In-flight implementer calls keyed by cache path, so concurrent identical
+# requests share one LLM round-trip instead of each issuing their own.
+_IMPL_INFLIGHT: Dict[Path, Future] = {}
+_IMPL_INFLIGHT_LOCK = threading.Lock()
+
+# Runs the test suite alongside the commit that follows a successful apply.
+_POST_APPLY_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="post-apply")
 
 
 # ---------------------------------------------------------------------------
@@ -37,25 +67,108 @@ def _load_plan(plan_id: str) -> Dict[str, Any]:
     path = _plan_path(plan_id)
     if not path.exists():
         raise FileNotFoundError(f"Plan not found: {path}")
-    return json.loads(path.read_text(encoding="utf-8"))
+    return orjson.loads(path.read_bytes())
 
 
 def _save_plan(plan_id: str, data: Dict[str, Any]) -> None:
     path = _plan_path(plan_id)
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    # Write to a sibling file and swap it in so a crash never leaves a torn plan.
+    tmp = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+    tmp.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    os.replace(tmp, path)
+
+
+@functools.lru_cache(maxsize=1)
+def _iso_for_second(epoch_second: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch_second))
 
 
 def _now_iso() -> str:
-    return datetime.utcnow().isoformat() + "Z"
+    # Second resolution is plenty for attempt logs and lets bursts reuse one string.
+    return _iso_for_second(int(time.time()))
+
+
+# ---------------------------------------------------------------------------
+# Shared pipeline components (stateless, so one instance serves every request)
+# ---------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=1)
+def _planner() -> Planner:
+    from planner import Planner
+
+    return Planner()
+
+
+@functools.lru_cache(maxsize=1)
+def _implementer() -> Implementer:
+    from implementer import Implementer
+
+    return Implementer()
+
+
+@functools.lru_cache(maxsize=1)
+def _verifier():
+    from verifier import Verifier  # Lazy import to avoid circular dependency
+
+    return Verifier()
 
 
 # ---------------------------------------------------------------------------
 # Planning stage
 # ---------------------------------------------------------------------------
 
+def _index_fingerprint() -> str:
+    """Changes whenever the vectorstore is written (repo or symbol ingest), so plans built
+    from older retrieval context are not reused."""
+    try:
+        st = (CHROMA_DIR / "chroma.sqlite3").stat()
+    except OSError:
+        return "none"
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+# The agent's own state lives under REPO_ROOT (settings paths are cwd-relative); writing
+# plans, caches or vectors must not count as a dirty tree.
+_AGENT_DIR_EXCLUDES = tuple(f":!{Path(d).as_posix()}" for d in (MEMORY_DIR, CHROMA_DIR, DATA_DIR))
+
+
+def _plan_cache_path(request_text: str) -> Optional[Path]:
+    """Cache slot for ``request_text`` against HEAD and the index state.
+
+    None outside a git checkout, and while the work tree (minus the agent's own
+    directories) is dirty: uncommitted edits are not part of HEAD, so a cached plan
+    could not reflect them.
+    """
+    try:
+        repo = _get_repo()
+        with _git_lock:
+            if repo.git.status("--porcelain", "--", ".", *_AGENT_DIR_EXCLUDES):
+                return None
+            head = repo.head.commit.hexsha
+    except Exception:
+        return None
+    key = hashlib.blake2b(
+        f"{request_text}|{head}|{_index_fingerprint()}|{_planner().model}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+    return PLAN_CACHE_DIR / f"{key}.json"
+
+
+def _create_plan_cached(request_text: str) -> Dict[str, Any]:
+    """Return the planner output for ``request_text``, reusing it while HEAD, index and model are unchanged."""
+    cache_path = _plan_cache_path(request_text)
+    if cache_path is not None and cache_path.exists():
+        try:
+            return orjson.loads(cache_path.read_bytes())
+        except orjson.JSONDecodeError:
+            pass
+    planner_result = _planner().create_plan(request_text)
+    if cache_path is not None:
+        cache_path.write_bytes(orjson.dumps(planner_result))
+    return planner_result
+
+
 def make_plan(request_text: str) -> Dict[str, Any]:
-    planner = Planner()
-    planner_result = planner.create_plan(request_text)
+    planner_result = _create_plan_cached(request_text)
 
     plan_id = f"plan_{uuid.uuid4().hex[:8]}"
     record: Dict[str, Any] = {
@@ -91,14 +204,65 @@ def _ensure_impl_section(record: Dict[str, Any]) -> Dict[str, Any]:
     return impl
 
 
+def _impl_cache_path(model: str, plan_input: Dict[str, Any], feedback: Optional[str], previous_patch: Optional[str]) -> Path:
+    payload = orjson.dumps(
+        {"model": model, "plan": plan_input, "feedback": feedback, "prev": previous_patch},
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+    )
+    return IMPL_CACHE_DIR / f"{hashlib.blake2b(payload, digest_size=16).hexdigest()}.json"
+
+
+def _generate_patch_cached(
+    implementer: Implementer,
+    plan_input: Dict[str, Any],
+    *,
+    feedback: Optional[str],
+    previous_patch: Optional[str],
+) -> Dict[str, Any]:
+    """Return the implementer attempt for these exact inputs, calling the LLM only on a miss."""
+    cache_path = _impl_cache_path(implementer.model, plan_input, feedback, previous_patch)
+    if cache_path.exists():
+        try:
+            cached = orjson.loads(cache_path.read_bytes())
+            return {**cached, "timestamp": _now_iso(), "cached": True}
+        except orjson.JSONDecodeError:
+            pass
+
+    with _IMPL_INFLIGHT_LOCK:
+        pending = _IMPL_INFLIGHT.get(cache_path)
+        if pending is None:
+            _IMPL_INFLIGHT[cache_path] = future = Future()
+    if pending is not None:
+        return {**pending.result(), "timestamp": _now_iso(), "cached": True}
+
+    try:
+        attempt = implementer.generate_patch(plan_input, feedback=feedback, previous_patch=previous_patch)
+        cache_path.write_bytes(orjson.dumps(attempt))
+        future.set_result(attempt)
+        return attempt
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _IMPL_INFLIGHT_LOCK:
+            _IMPL_INFLIGHT.pop(cache_path, None)
+
+
 def implement_plan(plan_id: str, *, feedback: Optional[str] = None) -> Dict[str, Any]:
-    record = _load_plan(plan_id)
+    return _implement_record(plan_id, _load_plan(plan_id), feedback=feedback)
+
+
+def _implement_record(plan_id: str, record: Dict[str, Any], *, feedback: Optional[str] = None) -> Dict[str, Any]:
+    """Run the implementer for an already-loaded ``record``, updating and saving it in place."""
+    from implementer import PatchValidationError
+
     impl_section = _ensure_impl_section(record)
-    implementer = Implementer()
+    implementer = _implementer()
     previous_patch = impl_section.get("final_patch")
 
     try:
-        attempt = implementer.generate_patch(
+        attempt = _generate_patch_cached(
+            implementer,
             {
                 "plan": record.get("plan"),
                 "planner": record.get("planner"),
@@ -121,6 +285,7 @@ def implement_plan(plan_id: str, *, feedback: Optional[str] = None) -> Dict[str,
     impl_section["final_patch"] = attempt["patch"]
     record["implementation"] = impl_section
     record["patch"] = attempt["patch"]
+    record["parsed_hunks"] = parse_patch_hunks(attempt["patch"])
     _save_plan(plan_id, record)
 
     return {
@@ -136,7 +301,7 @@ def implement_plan(plan_id: str, *, feedback: Optional[str] = None) -> Dict[str,
 # ---------------------------------------------------------------------------
 
 def verify_plan(plan_id: str, *, auto_fix: bool = True, max_rounds: int = 3) -> Dict[str, Any]:
-    from verifier import Verifier  # Lazy import to avoid circular dependency
+    from implementer import PatchValidationError
 
     record = _load_plan(plan_id)
     impl_section = _ensure_impl_section(record)
@@ -146,7 +311,7 @@ def verify_plan(plan_id: str, *, auto_fix: bool = True, max_rounds: int = 3) ->
     verification = record.setdefault("verification", {"attempts": [], "status": "pending"})
     attempts: List[Dict[str, Any]] = verification.setdefault("attempts", [])
 
-    verifier = Verifier()
+    verifier = _verifier()
     rounds = 0
     final_status = verification.get("status", "pending")
 
@@ -180,15 +345,12 @@ def verify_plan(plan_id: str, *, auto_fix: bool = True, max_rounds: int = 3) ->
             feedback_parts.append(
                 f"Check {chk.get('name')}: status={chk.get('status')} rc={chk.get('returncode')} stderr={chk.get('stderr')}"
             )
-        feedback = "\n\n".join([part for part in feedback_parts if part])
+        feedback = "\n\n".join(part for part in feedback_parts if part)
         if not feedback:
             break
         try:
-            implement_plan(plan_id, feedback=feedback)
-            record = _load_plan(plan_id)
-            impl_section = _ensure_impl_section(record)
-            verification = record.setdefault("verification", verification)
-            attempts = verification.setdefault("attempts", attempts)
+            # The record is updated in place, so there is no need to reload it from disk.
+            _implement_record(plan_id, record, feedback=feedback)
         except PatchValidationError:
             break
 
@@ -199,155 +361,346 @@ def verify_plan(plan_id: str, *, auto_fix: bool = True, max_rounds: int = 3) ->
 # Patch utilities and application helpers
 # ---------------------------------------------------------------------------
 
+# Line prefixes the hunk parser cares about; everything else is skipped with one check.
+_PATCH_MARKERS = ("diff --git", "@@", "+++ ")
+
+
 def parse_patch_hunks(patch_text: str) -> List[Dict[str, Any]]:
-    lines = patch_text.splitlines()
-    blocks: List[List[str]] = []
-    current: List[str] = []
-    for ln in lines:
-        if ln.startswith("diff --git"):
-            if current:
-                blocks.append(current)
-            current = [ln]
-        else:
-            if current:
-                current.append(ln)
-    if current:
-        blocks.append(current)
+    """Split ``patch_text`` into per-file hunk lists in a single pass.
 
+    Lines are never materialised: the scanner walks newline offsets and
+    slices each hunk straight out of ``patch_text``.
+    """
     parsed: List[Dict[str, Any]] = []
-    for block in blocks:
-        target = None
-        for ln in block:
-            if ln.startswith("+++ "):
-                target = ln.split(" ", 1)[1].strip()
-                if target.startswith("b/"):
-                    target = target[2:]
-                break
-        if not target and block:
-            header_parts = block[0].split()
+    text = patch_text
+    if "\r" in text:
+        # hunks are sliced verbatim, so CRLF/CR endings must become LF first to
+        # come out as clean, re-appliable text
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    size = len(text)
+    header: Optional[str] = None
+    target: Optional[str] = None
+    hunks: List[str] = []
+    hunk_start = -1
+
+    def _close_block(end: int) -> None:
+        if hunk_start >= 0:
+            hunks.append(text[hunk_start:end])
+        name = target
+        if not name:
+            header_parts = header.split()
             if len(header_parts) >= 4:
-                target = header_parts[3]
-                if target.startswith("b/"):
-                    target = target[2:]
-        hunks: List[str] = []
-        hunk_lines: List[str] = []
-        for ln in block:
-            if ln.startswith("@@"):
-                if hunk_lines:
-                    hunks.append("\n".join(hunk_lines))
-                hunk_lines = [ln]
-            else:
-                if hunk_lines:
-                    hunk_lines.append(ln)
-        if hunk_lines:
-            hunks.append("\n".join(hunk_lines))
-        parsed.append({"file": target or "unknown", "hunks": hunks})
+                name = header_parts[3]
+        if name and name.startswith("b/"):
+            name = name[2:]
+        parsed.append({"file": name or "unknown", "hunks": hunks})
+
+    pos = 0
+    while True:
+        nl = text.find("\n", pos)
+        if text.startswith(_PATCH_MARKERS, pos):
+            eol = size if nl == -1 else nl
+            if text.startswith("diff --git", pos):
+                if header is not None:
+                    _close_block(pos - 1)
+                header = text[pos:eol]
+                target = None
+                hunks = []
+                hunk_start = -1
+            elif header is not None:
+                if text.startswith("@@", pos):
+                    if hunk_start >= 0:
+                        hunks.append(text[hunk_start:pos - 1])
+                    hunk_start = pos
+                elif target is None:
+                    target = text[pos + 4:eol].strip()
+        if nl == -1:
+            break
+        pos = nl + 1
+    if header is not None:
+        _close_block(size - 1 if text.endswith("\n") else size)
     return parsed
 
 
+def _plan_hunks(record: Dict[str, Any], patch: str) -> List[Dict[str, Any]]:
+    cached = record.get("parsed_hunks")
+    if cached is not None:
+        return cached
+    return parse_patch_hunks(patch)
+
+
 def get_plan_hunks(plan_id: str) -> List[Dict[str, Any]]:
     record = _load_plan(plan_id)
     patch = record.get("implementation", {}).get("final_patch") or record.get("patch") or ""
     if not patch:
         return []
-    return parse_patch_hunks(patch)
+    return _plan_hunks(record, patch)
 
 
 def make_plan_files(plan_id: str) -> Dict[str, Any]:
     record = _load_plan(plan_id)
     plan = record.get("plan", {})
-    files = [item.get("path") for item in plan.get("files", []) if item.get("path")]
+    files = list(dict.fromkeys(item.get("path") for item in plan.get("files", []) if item.get("path")))
     return {"plan_id": plan_id, "files": files}
 
 
-def _write_tmp_patch(patch_text: str, tmp_path: Path) -> Path:
-    normalized = patch_text.replace("\r\n", "\n").replace("\r", "\n")
-    lines = [ln.rstrip() for ln in normalized.split("\n")]
-    tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
-    return tmp_path
+_DIFF_HEADER_RE = re.compile(rb"^diff --git a/(\S+) b/(\S+)", re.M)
+
+
+def _normalize_patch(patch_text: Union[str, bytes]) -> bytes:
+    """Return the patch as UTF-8 bytes with LF endings and no trailing whitespace.
+
+    The result is what every ``git apply`` attempt receives, so it is encoded once here.
+    """
+    buf = patch_text.encode("utf-8") if isinstance(patch_text, str) else patch_text
+    if b"\r" in buf:
+        buf = buf.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return b"\n".join(map(bytes.rstrip, buf.split(b"\n"))) + b"\n"
+
+
+def _git_path(name: str) -> str:
+    """Turn a ``---``/``+++`` name into a repo path: unquote git's C-style quoting, drop a/ b/."""
+    if len(name) > 1 and name.startswith('"') and name.endswith('"'):
+        name = codecs.escape_decode(name[1:-1].encode("utf-8"))[0].decode("utf-8", errors="replace")
+    if name.startswith(("a/", "b/")):
+        name = name[2:]
+    return "" if name == "/dev/null" else name
+
+
+def _patch_paths(patch: bytes, ps: Optional[PatchSet]) -> List[str]:
+    """Return every path the patch touches, source and target side.
+
+    Taken from the parsed ``PatchSet`` so blocks without a ``diff --git`` line, quoted
+    names and names with spaces all count; the header regex is only the fallback for a
+    patch unidiff could not parse.
+    """
+    paths: Dict[str, None] = {}
+    for pf in ps or []:
+        for name in (pf.source_file, pf.target_file):
+            path = _git_path(name or "")
+            if path:
+                paths.setdefault(path)
+    if ps is None:
+        for match in _DIFF_HEADER_RE.finditer(patch):
+            paths.setdefault(match.group(1).decode("utf-8", errors="replace"))
+            paths.setdefault(match.group(2).decode("utf-8", errors="replace"))
+    return list(paths)
+
+
+def _read_reject(wd: str, rel: str) -> Dict[str, Any]:
+    try:
+        content = (Path(wd) / rel).read_text(encoding="utf-8")
+    except Exception:
+        content = "<unreadable>"
+    return {"path": rel, "content": content}
+
+
+def _collect_rejects(wd: str, paths: List[str], *, scan_dirs: bool = True) -> List[Dict[str, Any]]:
+    """Find the ``.rej`` files ``git apply --reject`` left for ``paths``.
+
+    git writes ``<file>.rej`` next to each file, so those are checked
+    directly; only if none turn up (and ``scan_dirs`` is set) are the
+    touched directories listed.
+    """
+    found = [f"{rel}.rej" for rel in paths if os.path.exists(os.path.join(wd, f"{rel}.rej"))]
+    if not found and scan_dirs:
+        for rel_dir in {os.path.dirname(rel) for rel in paths}:
+            try:
+                with os.scandir(os.path.join(wd, rel_dir)) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".rej") and entry.is_file():
+                            found.append(os.path.join(rel_dir, entry.name).replace(os.sep, "/"))
+            except OSError:
+                continue
+    return [_read_reject(wd, rel) for rel in found]
+
+
+_APPLY_ARGS = ["git", "apply", "--whitespace=fix", "-"]
+_CHECK_ARGS = ["git", "apply", "--check", "--whitespace=fix", "-"]
+
+
+def _first_clean_check(candidates: List[Tuple[str, bytes]], wd: str) -> Tuple[Optional[Tuple[str, bytes]], List[Dict[str, Any]]]:
+    """Run ``git apply --check`` on every candidate at once and return the first that passes.
+
+    Checks still running once a winner is known are terminated. The second element holds
+    one attempt entry per check that finished.
+    """
+    results: "queue.Queue[Tuple[str, bytes, subprocess.Popen, bytes, bytes]]" = queue.Queue()
+
+    def _check(note: str, data: bytes, proc: subprocess.Popen) -> None:
+        out, err = proc.communicate(data)
+        results.put((note, data, proc, out, err))
+
+    procs = []
+    for note, data in candidates:
+        proc = subprocess.Popen(
+            _CHECK_ARGS, cwd=wd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        procs.append(proc)
+        threading.Thread(target=_check, args=(note, data, proc), daemon=True).start()
+
+    winner: Optional[Tuple[str, bytes]] = None
+    checks: List[Dict[str, Any]] = []
+    for _ in procs:
+        note, data, proc, out, err = results.get()
+        checks.append(
+            {
+                "returncode": proc.returncode,
+                "stdout": out.decode("utf-8", errors="replace"),
+                "stderr": err.decode("utf-8", errors="replace"),
+                "args": _CHECK_ARGS,
+                "note": note,
+            }
+        )
+        if proc.returncode == 0:
+            winner = (note, data)
+            break
+    for proc in procs:
+        if proc.poll() is None:
+            proc.terminate()
+    return winner, checks
+
+
+def apply_patch_text(patch_text: Union[str, bytes], wd: str = str(REPO_ROOT)) -> Dict[str, Any]:
+    attempts: List[Dict[str, Any]] = []
+    patch = _normalize_patch(patch_text)
 
+    from implementer import parse_patchset
 
-def apply_patch_text(patch_text: str, wd: str = str(REPO_ROOT)) -> Dict[str, Any]:
-    tmp = Path(wd) / ".agent_patch.tmp"
-    attempts: List[Dict[str, Any]] = []
+    # Parse once: the commit paths and both repair passes below share the same PatchSet.
+    try:
+        ps: Optional[PatchSet] = parse_patchset(patch.decode("utf-8", errors="replace"))
+        parse_error: Optional[Exception] = None
+    except Exception as exc:
+        ps, parse_error = None, exc
+    files = _patch_paths(patch, ps)
 
-    def _run(args: List[str]) -> Dict[str, Any]:
-        proc = subprocess.run(args, cwd=wd, capture_output=True, text=True)
+    def _run(args: List[str], data: bytes) -> Dict[str, Any]:
+        # The patch is fed on stdin ("-") so nothing is written into the work tree.
+        proc = subprocess.run(args, cwd=wd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return {
             "returncode": proc.returncode,
-            "stdout": proc.stdout,
-            "stderr": proc.stderr,
+            "stdout": proc.stdout.decode("utf-8", errors="replace"),
+            "stderr": proc.stderr.decode("utf-8", errors="replace"),
             "args": args,
         }
 
-    try:
-        _write_tmp_patch(patch_text, tmp)
-        attempts.append(_run(["git", "apply", "--whitespace=fix", str(tmp)]))
-        if attempts[-1]["returncode"] == 0:
-            return {"ok": True, "attempts": attempts}
-
-        # Try creating missing files/directories then retry
-        try:
-            ps = PatchSet(tmp.read_text(encoding="utf-8").splitlines(True))
-            for pf in ps:
-                target = pf.target_file or pf.path
-                if not target:
-                    continue
-                target = str(target)
-                if target.startswith("a/") or target.startswith("b/"):
-                    target = target[2:]
-                target_path = Path(wd) / target
-                if not target_path.exists():
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
-                    if not pf.is_added_file:
-                        target_path.write_text("", encoding="utf-8")
-        except Exception:
-            pass
+    attempts.append(_run(_APPLY_ARGS, patch))
+    if attempts[-1]["returncode"] == 0:
+        return {"ok": True, "attempts": attempts, "files": files}
 
-        attempts.append(_run(["git", "apply", "--whitespace=fix", str(tmp)]))
+    # Try creating missing files/directories then retry
+    try:
+        for pf in ps or []:
+            target = pf.target_file or pf.path
+            if not target:
+                continue
+            target = str(target)
+            if target.startswith(("a/", "b/")):
+                target = target[2:]
+            target_path = Path(wd) / target
+            if not target_path.exists():
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                if not pf.is_added_file:
+                    target_path.write_text("", encoding="utf-8")
+    except Exception:
+        pass
+
+    # Retry the original patch and its unidiff re-serialisation (which fixes format
+    # oddities) side by side: both are checked concurrently and the first clean one is applied.
+    candidates = [("created_missing_files", patch)]
+    if ps is not None:
+        repaired = str(ps).encode("utf-8")
+        if repaired != patch:
+            candidates.append(("repaired_with_unidiff", repaired))
+    else:
+        attempts.append({"returncode": -1, "stdout": "", "stderr": f"unidiff parse failed: {parse_error}"})
+    winner, checks = _first_clean_check(candidates, wd)
+    attempts.extend(checks)
+    if winner is not None:
+        note, data = winner
+        attempts.append(_run(_APPLY_ARGS, data))
         if attempts[-1]["returncode"] == 0:
-            return {"ok": True, "attempts": attempts, "note": "created_missing_files"}
+            return {"ok": True, "attempts": attempts, "files": files, "note": note}
+    patch = candidates[-1][1]
 
-        # Serialize via unidiff to fix format oddities
-        try:
-            ps = PatchSet(tmp.read_text(encoding="utf-8").splitlines(True))
-            tmp.write_text(str(ps), encoding="utf-8")
-            attempts.append(_run(["git", "apply", "--whitespace=fix", str(tmp)]))
-            if attempts[-1]["returncode"] == 0:
-                return {"ok": True, "attempts": attempts, "note": "repaired_with_unidiff"}
-        except Exception as exc:
-            attempts.append({"returncode": -1, "stdout": "", "stderr": f"unidiff parse failed: {exc}"})
-
-        # Final fallback: git apply --reject
-        attempts.append(_run(["git", "apply", "--reject", "--whitespace=fix", str(tmp)]))
-        rejected: List[Dict[str, Any]] = []
-        for rej_file in Path(wd).rglob("*.rej"):
-            try:
-                rejected.append({"path": str(rej_file.relative_to(wd)), "content": rej_file.read_text(encoding="utf-8")})
-            except Exception:
-                rejected.append({"path": str(rej_file), "content": "<unreadable>"})
-        return {"ok": False, "attempts": attempts, "rejected": rejected}
-    finally:
-        try:
-            tmp.unlink()
-        except Exception:
-            pass
+    # Final fallback: git apply --reject
+    attempts.append(_run(["git", "apply", "--reject", "--whitespace=fix", "-"], patch))
+    # ``files`` already comes from unidiff when the patch parsed, so the directory
+    # listing is only needed when it did not parse at all.
+    rejected = _collect_rejects(wd, files, scan_dirs=ps is None)
+    return {"ok": False, "attempts": attempts, "files": files, "rejected": rejected}
 
 
 # ---------------------------------------------------------------------------
 # Git utilities
 # ---------------------------------------------------------------------------
 
-def commit_changes(message_suffix: str = "") -> str:
-    repo = Repo(REPO_ROOT)
-    author = Actor(GIT_COMMIT_AUTHOR[0], GIT_COMMIT_AUTHOR[1])
-    repo.git.add(all=True)
-    repo.index.commit(
-        GIT_COMMIT_MESSAGE + (f" {message_suffix}" if message_suffix else ""),
-        author=author,
-        committer=author,
-    )
-    return repo.head.commit.hexsha
+_repo: Optional[Repo] = None
+_repo_lock = threading.Lock()
+# GitPython objects are not thread-safe and handlers run on worker threads, so every
+# index/commit operation on the shared Repo goes through this lock (reentrant: commit
+# holds it while staging)
+_git_lock = threading.RLock()
+
+
+def _get_repo() -> Repo:
+    """Return the shared ``Repo`` for REPO_ROOT, opened on first use."""
+    global _repo
+    with _repo_lock:
+        if _repo is None:
+            from git import Repo
+
+            _repo = Repo(REPO_ROOT)
+        return _repo
+
+
+@functools.lru_cache(maxsize=1)
+def _agent_actor() -> Actor:
+    from git import Actor
+
+    return Actor(GIT_COMMIT_AUTHOR[0], GIT_COMMIT_AUTHOR[1])
+
+
+def _stage_paths(repo: Repo, paths: List[str]) -> None:
+    """Stage ``paths`` through GitPython's in-process index instead of ``git add -A``."""
+    present = [p for p in paths if (REPO_ROOT / p).exists()]
+    missing = [p for p in paths if not (REPO_ROOT / p).exists()]
+    with _git_lock:
+        if present:
+            repo.index.add(present)
+        if missing:
+            repo.index.remove(missing, ignore_unmatch=True)
+
+
+def commit_changes(message_suffix: str = "", paths: Optional[List[str]] = None) -> str:
+    repo = _get_repo()
+    with _git_lock:
+        # no paths (None, or a patch nothing could be read from) stages everything
+        if not paths:
+            repo.git.add(all=True)
+        else:
+            _stage_paths(repo, paths)
+        if not repo.index.diff("HEAD"):
+            # staging matched nothing the patch changed; an empty agent commit would hide that
+            raise RuntimeError(f"Nothing staged for the agent commit (paths: {paths or 'all'}); refusing an empty commit.")
+        repo.index.commit(
+            GIT_COMMIT_MESSAGE + (f" {message_suffix}" if message_suffix else ""),
+            author=_agent_actor(),
+            committer=_agent_actor(),
+        )
+        return repo.head.commit.hexsha
+
+
+# Only the last lines of test output are kept; callers feed back tails anyway.
+TEST_OUTPUT_TAIL_LINES = 4096
+_PIPE_BUFSIZE = 65536
+
+
+def _drain_tail(stream: IO[bytes], tail: Deque[bytes]) -> None:
+    with stream:
+        for line in stream:
+            tail.append(line)
 
 
 def run_tests() -> Dict[str, Any]:
@@ -357,55 +710,107 @@ def run_tests() -> Dict[str, Any]:
     else:
         args = list(cmd)
     try:
-        proc = subprocess.run(args, cwd=str(REPO_ROOT), capture_output=True, text=True, timeout=300)
-        return {"returncode": proc.returncode, "stdout": proc.stdout, "stderr": proc.stderr}
-    except subprocess.TimeoutExpired:
-        return {"returncode": 124, "stdout": "", "stderr": "Tests timed out."}
+        proc = subprocess.Popen(
+            args,
+            cwd=str(REPO_ROOT),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=_PIPE_BUFSIZE,
+            start_new_session=os.name == "posix",
+        )
     except Exception as exc:
         return {"returncode": 1, "stdout": "", "stderr": str(exc)}
 
+    stdout_tail: Deque[bytes] = deque(maxlen=TEST_OUTPUT_TAIL_LINES)
+    stderr_tail: Deque[bytes] = deque(maxlen=TEST_OUTPUT_TAIL_LINES)
+    readers = [
+        threading.Thread(target=_drain_tail, args=(proc.stdout, stdout_tail), daemon=True),
+        threading.Thread(target=_drain_tail, args=(proc.stderr, stderr_tail), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        proc.wait(timeout=300)
+    except subprocess.TimeoutExpired:
+        # Kill the whole session: workers spawned by the test runner hold the pipes
+        # open and would otherwise leak and keep the reader threads blocked.
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+        proc.wait()
+        return {"returncode": 124, "stdout": "", "stderr": "Tests timed out."}
+    finally:
+        for reader in readers:
+            reader.join()
+    return {
+        "returncode": proc.returncode,
+        "stdout": b"".join(stdout_tail).decode("utf-8", errors="replace"),
+        "stderr": b"".join(stderr_tail).decode("utf-8", errors="replace"),
+    }
 
+
+def _commit_and_test(paths: List[str], message_suffix: str = "") -> Tuple[str, Dict[str, Any]]:
+    # Only ``paths`` are staged, so files the tests write cannot leak into the commit.
+    tests_future = _POST_APPLY_POOL.submit(run_tests)
+    try:
+        commit = commit_changes(message_suffix, paths=paths)
+    except Exception:
+        # never leave an unowned test run behind: drop it if still queued, else let it
+        # finish (bounded by run_tests' own timeout) before the error propagates
+        if not tests_future.cancel():
+            try:
+                tests_future.result()
+            except Exception:
+                pass
+        raise
+    return commit, tests_future.result()
+
+
 def apply_plan(plan_id: str) -> Dict[str, Any]:
     record = _load_plan(plan_id)
     patch = record.get("implementation", {}).get("final_patch") or record.get("patch")
     if not patch:
         raise RuntimeError("No patch stored for plan. Run implement_plan first.")
-    apply_patch_text(patch)
-    commit = commit_changes()
-    tests = run_tests()
-    return {"applied": True, "commit": commit, "tests": tests}
-
-
+    applied = apply_patch_text(patch)
+    commit, tests = _commit_and_test(applied["files"])
+    # a --reject fallback commits what did apply; the .rej leftovers say what did not
+    return {"applied": True, "commit": commit, "tests": tests, "rejected": applied.get("rejected", [])}
+
+
+def _append_file_block(parts: List[str], path: str, hunks: List[str]) -> None:
+    """Append a ``diff --git`` block for ``path`` to the flat ``parts`` buffer."""
+    if parts:
+        parts.append("\n")
+    parts.append(f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n")
+    parts.append("\n".join(hunks))
+
+
 def apply_plan_files(plan_id: str, files: List[str]) -> Dict[str, Any]:
     record = _load_plan(plan_id)
     patch = record.get("implementation", {}).get("final_patch") or record.get("patch")
     if not patch:
         raise RuntimeError("No patch stored for plan. Run implement_plan first.")
-    ps = PatchSet(patch.splitlines(True))
-    out_blocks: List[str] = []
+    from implementer import parse_patchset
+
+    ps = parse_patchset(patch)
+    wanted = set(files)
+    buf = io.StringIO()
     for pf in ps:
-        target = (pf.target_file or pf.path or "").replace("b/", "").replace("a/", "")
-        if target not in files:
+        target = pf.target_file or pf.path or ""
+        if target.startswith(("a/", "b/")):
+            target = target[2:]
+        if target not in wanted or not len(pf):
             continue
-        header = f"diff --git a/{target} b/{target}\n--- a/{target}\n+++ b/{target}\n"
-        hunks: List[str] = []
-        for h in pf:
-            h_lines = [str(h.header).rstrip()]
-            for line in h:
-                try:
-                    h_lines.append(line.value.rstrip("\n"))
-                except Exception:
-                    h_lines.append(str(line))
-            hunks.append("\n".join([ln for ln in h_lines if ln]))
-        if hunks:
-            out_blocks.append(header + "\n".join(hunks))
-    if not out_blocks:
+        buf.write(f"diff --git a/{target} b/{target}\n--- a/{target}\n+++ b/{target}\n")
+        # str(hunk) is the "@@" header plus every line with its +/-/space prefix and newline.
+        buf.writelines(map(str, pf))
+    partial_patch = buf.getvalue()
+    if not partial_patch:
         raise RuntimeError("No matching files found in patch")
-    partial_patch = "\n".join(out_blocks)
-    apply_patch_text(partial_patch)
-    commit = commit_changes("(partial)")
-    tests = run_tests()
-    return {"applied": True, "commit": commit, "tests": tests, "files": files}
+    applied = apply_patch_text(partial_patch)
+    commit, tests = _commit_and_test(applied["files"], "(partial)")
+    return {"applied": True, "commit": commit, "tests": tests, "files": files, "rejected": applied.get("rejected", [])}
 
 
 def apply_plan_hunks(plan_id: str, selections: Dict[str, List[int]]) -> Dict[str, Any]:
@@ -413,32 +818,30 @@ def apply_plan_hunks(plan_id: str, selections: Dict[str, List[int]]) -> Dict[str
     patch = record.get("implementation", {}).get("final_patch") or record.get("patch")
     if not patch:
         raise RuntimeError("No patch stored for plan. Run implement_plan first.")
-    parsed = parse_patch_hunks(patch)
-    out_blocks: List[str] = []
+    parsed = _plan_hunks(record, patch)
+    parts: List[str] = []
     for block in parsed:
         path = block.get("file")
         chosen = selections.get(path, [])
         if not chosen:
             continue
-        header = f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n"
         hunks = [block["hunks"][idx] for idx in chosen if 0 <= idx < len(block["hunks"]) ]
         if hunks:
-            out_blocks.append(header + "\n".join(hunks))
-    if not out_blocks:
+            _append_file_block(parts, path, hunks)
+    if not parts:
         raise RuntimeError("No hunks selected")
-    partial_patch = "\n".join(out_blocks)
-    apply_patch_text(partial_patch)
-    commit = commit_changes("(hunks)")
-    tests = run_tests()
-    return {"applied": True, "commit": commit, "tests": tests, "selections": selections}
+    partial_patch = "".join(parts)
+    applied = apply_patch_text(partial_patch)
+    commit, tests = _commit_and_test(applied["files"], "(hunks)")
+    return {"applied": True, "commit": commit, "tests": tests, "selections": selections, "rejected": applied.get("rejected", [])}
 
 
 def revert_commit(commit_sha: str) -> Dict[str, Any]:
-    repo = Repo(REPO_ROOT)
-    if repo.is_dirty(untracked_files=True):
-        raise RuntimeError("Working tree is dirty. Commit or stash changes first.")
-    repo.git.revert("--no-commit", commit_sha)
-    author = Actor(GIT_COMMIT_AUTHOR[0], GIT_COMMIT_AUTHOR[1])
-    repo.git.add(all=True)
-    repo.index.commit(f"revert(agent): {commit_sha}", author=author, committer=author)
-    return {"reverted": True, "new_commit": repo.head.commit.hexsha}
+    repo = _get_repo()
+    with _git_lock:
+        if repo.is_dirty(untracked_files=True):
+            raise RuntimeError("Working tree is dirty. Commit or stash changes first.")
+        # The tree was clean, so ``revert --no-commit`` has already staged exactly the revert.
+        repo.git.revert("--no-commit", commit_sha)
+        repo.index.commit(f"revert(agent): {commit_sha}", author=_agent_actor(), committer=_agent_actor())
+        return {"reverted": True, "new_commit": repo.head.commit.hexsha}
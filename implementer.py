@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-import json
+import functools
+import re
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import AbstractSet, Any, Dict, List, Optional
 
+import orjson
 from unidiff import PatchSet, UnidiffParseError
 
-from settings import LLM_MODEL
+from settings import IMPL_CONTEXT_BLOCKS, LLM_MODEL
 from llm_utils import chat_once
 
 
@@ -14,6 +16,42 @@ class PatchValidationError(RuntimeError):
     """Raised when an implementer response fails structural validation."""
 
 
+@functools.lru_cache(maxsize=64)
+def parse_patchset(patch_text: str) -> PatchSet:
+    """Parse ``patch_text`` with unidiff, memoised per distinct patch.
+
+    The returned ``PatchSet`` is shared between callers and must not be mutated.
+    """
+    return PatchSet(patch_text.splitlines(keepends=True))
+
+
+_CONTEXT_HEADER = "\n--- CONTEXT ---\n"
+_BLOCK_START_RE = re.compile(r"^(?=\[[^\]\n]* :: [^\]\n]*\]$)", re.M)
+_WORD_RE = re.compile(r"\w+")
+
+
+def _compress_context(context_text: str, plan_dump: str, allowed_files: List[str], keep: int) -> str:
+    """Keep the ``keep`` context blocks that overlap the plan most, in their original order.
+
+    Blocks are the ``[source :: chunk]`` sections emitted by ``rag_core.build_context_block``.
+    A block scores one point per word it shares with the plan, and ranks ahead of all others
+    when its source is one of the plan's files.
+    """
+    body = context_text[len(_CONTEXT_HEADER):] if context_text.startswith(_CONTEXT_HEADER) else context_text
+    blocks = [b for b in _BLOCK_START_RE.split(body) if b.strip()]
+    if len(blocks) <= keep:
+        return context_text
+    plan_words = set(_WORD_RE.findall(plan_dump))
+    scored = []
+    for idx, block in enumerate(blocks):
+        header = block.split("\n", 1)[0]
+        in_plan = any(path and path in header for path in allowed_files)
+        overlap = len(plan_words.intersection(_WORD_RE.findall(block)))
+        scored.append((in_plan, overlap, -idx))
+    top = sorted(range(len(blocks)), key=scored.__getitem__, reverse=True)[:keep]
+    return _CONTEXT_HEADER + "".join(blocks[i] for i in sorted(top))
+
+
 class Implementer:
     """Generate unified diffs that obey a previously approved plan."""
 
@@ -45,7 +83,10 @@ Return a unified diff that can be applied with `git apply`. Follow these rules:
             or ""
         )
         allowed_files = [item.get("path") for item in plan_json.get("files", []) if item.get("path")]
-        plan_dump = json.dumps(plan_json, ensure_ascii=False, indent=2)
+        # compact JSON: indentation is pure prompt-token overhead for the model
+        plan_dump = orjson.dumps(plan_json, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        # the plan already distils the request, so only the snippets it points at are resent
+        context_text = _compress_context(context_text, plan_dump, allowed_files, IMPL_CONTEXT_BLOCKS)
 
         user_parts = [
             "Approved plan JSON:",
@@ -71,26 +112,28 @@ Return a unified diff that can be applied with `git apply`. Follow these rules:
         ]
         return messages
 
-    def _validate_patch(self, patch_text: str, allowed_files: List[str]) -> Dict[str, Any]:
+    def _validate_patch(self, patch_text: str, allowed_files: AbstractSet[str]) -> Dict[str, Any]:
         patch = patch_text.strip()
         if not patch:
             raise PatchValidationError("Implementer returned an empty patch")
         if "diff --git" not in patch:
             raise PatchValidationError("Patch must start with 'diff --git' blocks")
         try:
-            ps = PatchSet(patch.splitlines(keepends=True))
+            ps = parse_patchset(patch)
         except UnidiffParseError as exc:
             raise PatchValidationError(f"Patch could not be parsed: {exc}") from exc
 
-        touched = []
+        touched = set()
         for pf in ps:
-            target = (pf.target_file or pf.path or pf.source_file or "").replace("b/", "").replace("a/", "")
+            target = pf.target_file or pf.path or pf.source_file or ""
+            if target.startswith(("a/", "b/")):
+                target = target[2:]
             if allowed_files and target not in allowed_files:
                 raise PatchValidationError(f"Patch modifies '{target}' which is outside the approved file list")
-            touched.append(target)
+            touched.add(target)
         if not touched:
             raise PatchValidationError("Patch contains no file modifications")
-        return {"files": sorted(set(touched)), "patch_text": patch}
+        return {"files": sorted(touched), "patch_text": patch}
 
     def generate_patch(
         self,
@@ -102,7 +145,7 @@ Return a unified diff that can be applied with `git apply`. Follow these rules:
         plan_json = plan_record.get("plan") or plan_record.get("planner", {}).get("plan")
         if plan_json is None:
             raise ValueError("Plan data missing from record")
-        allowed_files = [item.get("path") for item in plan_json.get("files", []) if item.get("path")]
+        allowed_files = {item.get("path") for item in plan_json.get("files", []) if item.get("path")}
 
         messages = self._build_messages(
             plan_record,
@@ -1,25 +1,68 @@
+import functools
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from settings import DATA_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+from typing import Iterator, Optional
+from settings import DATA_DIR, CHUNK_SIZE, CHUNK_OVERLAP, PDF_PROCESS_MIN_PAGES
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from rag_core import get_vectorstore
+from rag_core import get_vectorstore, BatchedAdder
+
+def _load_plain(fp: Path) -> str:
+    return fp.read_text(encoding="utf-8", errors="ignore")
+
+def _load_pdf(fp: Path) -> str:
+    from pypdf import PdfReader
+    reader = PdfReader(str(fp))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+def _load_unstructured(fp: Path) -> str:
+    # unstructured drags in a large optional ML stack, so only import it for files that need it
+    from unstructured.partition.auto import partition
+    els = partition(filename=str(fp))
+    return "\n".join(getattr(e, 'text', '') for e in els if getattr(e, 'text', ''))
+
+_LOADERS = {".txt": _load_plain, ".md": _load_plain, ".pdf": _load_pdf}
 
 def load_text(fp: Path) -> str:
-    ext = fp.suffix.lower()
-    if ext in [".txt", ".md"]:
-        return fp.read_text(encoding="utf-8", errors="ignore")
-    elif ext == ".pdf":
-        from pypdf import PdfReader
-        reader = PdfReader(str(fp))
-        return "\n".join(page.extract_text() or "" for page in reader.pages)
-    else:
-        from unstructured.partition.auto import partition
-        els = partition(filename=str(fp))
-        return "\n".join(getattr(e, 'text', '') for e in els if getattr(e, 'text', ''))
+    return _LOADERS.get(fp.suffix.lower(), _load_unstructured)(fp)
+
+@functools.lru_cache(maxsize=4)
+def _pdf_reader(path: str):
+    from pypdf import PdfReader
+    return PdfReader(path)
+
+def _pdf_page_text(job):
+    # runs in a worker process; the reader is cached so each worker opens a file once
+    path, idx = job
+    return _pdf_reader(path).pages[idx].extract_text() or ""
+
+def iter_page_texts(fp: Path, pdf_pool: Optional[ProcessPoolExecutor] = None) -> Iterator[str]:
+    if fp.suffix.lower() != ".pdf":
+        yield load_text(fp)
+        return
+    from pypdf import PdfReader
+    reader = PdfReader(str(fp))
+    n = len(reader.pages)
+    if pdf_pool is None or n < PDF_PROCESS_MIN_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+    yield from pdf_pool.map(_pdf_page_text, [(str(fp), i) for i in range(n)], chunksize=4)
+
+_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
 
 def chunk_text(text: str):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    return splitter.split_text(text)
+    return _SPLITTER.split_text(text)
+
+def _load_chunks(fp: Path, pdf_pool: Optional[ProcessPoolExecutor] = None):
+    try:
+        chunks = []
+        for txt in iter_page_texts(fp, pdf_pool):
+            if txt.strip():
+                chunks.extend(chunk_text(txt))
+        return fp, chunks, None
+    except Exception as e:
+        return fp, [], e
 
 def main():
     vs = get_vectorstore(collection_name="docs")
@@ -27,20 +70,27 @@ def main():
     for root, _, fns in os.walk(DATA_DIR):
         for fn in fns:
             files.append(Path(root)/fn)
-    added = 0
-    for fp in files:
-        try:
-            txt = load_text(fp)
-            if not txt.strip(): continue
-            chunks = chunk_text(txt)
+    batcher = BatchedAdder(vs)
+    # files are loaded/split on worker threads; embeddings go out once per batch
+    # PDF text extraction is CPU-bound, so large PDFs fan their pages out to processes
+    with ProcessPoolExecutor() as pdf_pool, ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        load = functools.partial(_load_chunks, pdf_pool=pdf_pool)
+        for fp, chunks, err in pool.map(load, files):
+            if err is not None:
+                print("Error:", err)
+                continue
+            if not chunks: continue
             metadatas = [{"source": str(fp), "chunk": i, "kind": "doc"} for i, _ in enumerate(chunks)]
             ids = [f"{fp}:{i}" for i,_ in enumerate(chunks)]
-            if chunks:
-                vs.add_texts(chunks, metadatas=metadatas, ids=ids)
-                added += len(chunks)
-        except Exception as e:
-            print("Error:", e)
-    print("Done. Added:", added)
+            try:
+                batcher.add(chunks, metadatas, ids)
+            except Exception as e:
+                print("Error:", e)
+    try:
+        batcher.flush()
+    except Exception as e:
+        print("Error:", e)
+    print("Done. Added:", batcher.added)
 
 if __name__ == '__main__':
     main()
@@ -4,6 +4,11 @@ from __future__ import annotations
 from typing import List, Dict
 import ollama
 
+from settings import LLM_KEEP_ALIVE
+
+# One client per process so every call reuses the same HTTP connection pool.
+_client = ollama.Client()
+
 
 def chat_once(model: str, messages: List[Dict[str, str]], *, stream: bool = False) -> str:
     """Send a list of chat ``messages`` to ``model`` and return the assistant response.
@@ -20,13 +25,13 @@ def chat_once(model: str, messages: List[Dict[str, str]], *, stream: bool = Fals
     """
     if stream:
         response_chunks = []
-        for part in ollama.chat(model=model, messages=messages, stream=True):
+        for part in _client.chat(model=model, messages=messages, stream=True, keep_alive=LLM_KEEP_ALIVE):
             msg = part.get("message") or {}
             content = msg.get("content")
             if content:
                 response_chunks.append(content)
         return "".join(response_chunks)
 
-    response = ollama.chat(model=model, messages=messages, stream=False)
+    response = _client.chat(model=model, messages=messages, stream=False, keep_alive=LLM_KEEP_ALIVE)
     message = response.get("message") or {}
     return message.get("content", "").strip()
@@ -1,7 +1,12 @@
+import fnmatch
+import functools
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pathspec import PathSpec
 from pathspec.patterns.gitwildmatch import GitWildMatchPattern
-from rag_core import get_vectorstore
+from rag_core import get_vectorstore, BatchedAdder
 from settings import REPO_ROOT, INCLUDE_GLOBS, EXCLUDE_GLOBS, RESPECT_GITIGNORE, CHUNK_SIZE, CHUNK_OVERLAP
 from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
 from tqdm import tqdm
@@ -14,47 +19,87 @@ def load_gitignore(root: Path) -> PathSpec:
         return PathSpec.from_lines(GitWildMatchPattern, [])
     return PathSpec.from_lines(GitWildMatchPattern, gi.read_text().splitlines())
 
+def _glob_re(patterns):
+    alts = []
+    for pat in patterns:
+        alts.append(fnmatch.translate(pat))
+        if pat.startswith("**/"):
+            # like pathlib, a leading "**/" also matches zero directories
+            alts.append(fnmatch.translate(pat[3:]))
+    return re.compile("|".join(alts) or "(?!)")
+
+_INCL_RE = _glob_re(INCLUDE_GLOBS)
+_EXCL_RE = _glob_re(EXCLUDE_GLOBS)
+
 def iter_files(root: Path):
     spec = load_gitignore(root) if RESPECT_GITIGNORE else PathSpec.from_lines(GitWildMatchPattern, [])
-    include = set()
-    for pat in INCLUDE_GLOBS:
-        include.update(root.glob(pat))
-    ex_paths = set()
-    for pat in EXCLUDE_GLOBS:
-        ex_paths.update(root.glob(pat))
-    for p in sorted(include):
-        rel = p.relative_to(root)
-        if RESPECT_GITIGNORE and spec.match_file(str(rel).replace("\\","/")):
+    # single scandir walk; excluded/ignored directories are pruned instead of descended
+    stack = [(str(root), "")]
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            it = os.scandir(path)
+        except OSError:
             continue
-        if p.is_file() and p.stat().st_size < 1_000_000:
-            yield p
+        with it:
+            for entry in it:
+                rel = prefix + entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        rel_dir = rel + "/"
+                        if _EXCL_RE.match(rel_dir) or (RESPECT_GITIGNORE and spec.match_file(rel_dir)):
+                            continue
+                        stack.append((entry.path, rel_dir))
+                        continue
+                    if not _INCL_RE.match(rel) or _EXCL_RE.match(rel):
+                        continue
+                    if RESPECT_GITIGNORE and spec.match_file(rel):
+                        continue
+                    if entry.is_file() and entry.stat().st_size < 1_000_000:
+                        yield Path(entry.path)
+                except OSError:
+                    continue
 
+# splitters are stateless w.r.t. input, so one instance per extension is shared
+@functools.lru_cache(maxsize=32)
 def code_splitter(ext: str):
     lang = LANG_MAP.get(ext.lower())
     if lang:
         return RecursiveCharacterTextSplitter.from_language(language=lang, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
 
+def _split_file(fp: Path):
+    try:
+        text = fp.read_text(encoding="utf-8", errors="ignore")
+        if not text.strip(): return fp, [], None
+        return fp, code_splitter(fp.suffix).split_text(text), None
+    except Exception as e:
+        return fp, [], e
+
 def main():
     vs = get_vectorstore(collection_name="repo")
-    added = 0
-    for fp in tqdm(iter_files(REPO_ROOT), desc="Indexing repo"):
-        try:
-            text = fp.read_text(encoding="utf-8", errors="ignore")
-            if not text.strip(): continue
-            splitter = code_splitter(fp.suffix)
-            chunks = splitter.split_text(text)
+    batcher = BatchedAdder(vs)
+    # files are read/split on worker threads; embeddings go out once per batch
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for fp, chunks, err in tqdm(pool.map(_split_file, iter_files(REPO_ROOT)), desc="Indexing repo"):
+            if err is not None:
+                print("Err:", err)
+                continue
             metadatas = []
             ids = []
             for i, ch in enumerate(chunks):
                 metadatas.append({"source": str(fp), "chunk": i, "ext": fp.suffix.lower(), "kind": "code"})
                 ids.append(f"{fp}:{i}")
             if chunks:
-                vs.add_texts(chunks, metadatas=metadatas, ids=ids)
-                added += len(chunks)
-        except Exception as e:
-            print("Err:", e)
-    print("Done. Added:", added)
+                try:
+                    batcher.add(chunks, metadatas, ids)
+                except Exception as e:
+                    print("Err:", e)
+    try:
+        batcher.flush()
+    except Exception as e:
+        print("Err:", e)
+    print("Done. Added:", batcher.added)
 
 if __name__ == '__main__':
     main()
@@ -1,21 +1,71 @@
 # orchestrator.py
 from pathlib import Path
-import json
+import orjson
+import asyncio
 import traceback
 import tempfile
 import shutil
 import subprocess
 import os
 import shlex
-from typing import Dict, Any, List, Optional
-from settings import REPO_ROOT, GIT_COMMIT_AUTHOR, GIT_COMMIT_MESSAGE, CHROMA_DIR
+import signal
+import importlib.util
+import queue
+import threading
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+from settings import REPO_ROOT, GIT_COMMIT_AUTHOR, GIT_COMMIT_MESSAGE, CHROMA_DIR, DATA_DIR, MEMORY_DIR, TEST_PARALLEL
 from dev_workflow import PLANS_DIR, apply_patch_text
 from git import Repo, InvalidGitRepositoryError
 
 
 
+async def _exec_async(cmd_list: List[str], wd: str, timeout: Optional[float] = None) -> Tuple[int, str, str]:
+    """
+    Runs cmd_list in wd without blocking the event loop.
+    Raises subprocess.TimeoutExpired (after killing the process group) if it overruns timeout.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd_list, cwd=wd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=os.name == "posix",
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        # Kill the whole session: xdist workers inherit the pipes and would otherwise keep
+        # communicate() waiting long past the timeout.
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except ProcessLookupError:
+            pass
+        out, _ = await proc.communicate()
+        raise subprocess.TimeoutExpired(cmd_list, timeout, output=out.decode("utf-8", "replace"))
+    return proc.returncode, out.decode("utf-8", "replace"), err.decode("utf-8", "replace")
+
+def _with_xdist(cmd_list: List[str]) -> List[str]:
+    """
+    Spread a pytest run over worker processes with pytest-xdist (files stay on one worker).
+    Leaves the command alone when it is not pytest, already picks -n, TEST_PARALLEL
+    disables it, or xdist is not installed.
+    """
+    if not cmd_list or Path(cmd_list[0]).name != "pytest" or TEST_PARALLEL is False:
+        return cmd_list
+    if any(arg == "-n" or arg.startswith(("-n=", "--numprocesses")) for arg in cmd_list):
+        return cmd_list
+    if importlib.util.find_spec("xdist") is None:
+        return cmd_list
+    if TEST_PARALLEL is None or TEST_PARALLEL is True:
+        # keep two cores for the agent/server process itself
+        workers = max(1, (os.cpu_count() or 1) - 2)
+    else:
+        workers = int(TEST_PARALLEL)
+    return [*cmd_list, "-n", str(workers), "--dist=loadfile"]
+
 # Helper: run tests in given working dir
-def run_tests_in_dir(wd: str, timeout: int = 300) -> Dict[str, Any]:
+async def run_tests_in_dir_async(wd: str, timeout: int = 300) -> Dict[str, Any]:
     """
     Runs tests using settings.TEST_CMD if present, otherwise 'pytest -q'.
     Returns dict with returncode, stdout, stderr.
@@ -26,88 +76,300 @@ def run_tests_in_dir(wd: str, timeout: int = 300) -> Dict[str, Any]:
         cmd_list = cmd.split()  # simple split
     else:
         cmd_list = cmd
+    cmd_list = _with_xdist(list(cmd_list))
     try:
-        res = subprocess.run(cmd_list, cwd=wd, capture_output=True, text=True, timeout=timeout)
-        return {"returncode": res.returncode, "stdout": res.stdout, "stderr": res.stderr}
+        returncode, stdout, stderr = await _exec_async(cmd_list, wd, timeout)
+        return {"returncode": returncode, "stdout": stdout, "stderr": stderr}
     except subprocess.TimeoutExpired as e:
         return {"returncode": -1, "stdout": e.stdout or "", "stderr": f"TimeoutExpired: {e}"}
     except Exception as e:
         return {"returncode": -2, "stdout": "", "stderr": str(e)}
 
-def _apply_patch_via_git_apply(patch_text: str, wd: str) -> Dict[str, Any]:
+def run_tests_in_dir(wd: str, timeout: int = 300) -> Dict[str, Any]:
+    return asyncio.run(run_tests_in_dir_async(wd, timeout=timeout))
+
+def _fast_rmtree(path: str) -> None:
     """
-    Writes patch_text to temp file and runs 'git apply <tmp>' in wd.
-    Returns {"ok": bool, "stderr": ..., "stdout": ...}
+    Delete a directory tree with the platform's native tool (one process instead of a
+    Python-level walk), falling back to shutil.rmtree if that fails or leaves anything behind.
     """
-    tmp = Path(wd) / ".agent_tmp_patch.patch"
-    tmp.write_text(patch_text, encoding="utf-8")
     try:
-        proc = subprocess.run(["git", "apply", str(tmp)], cwd=wd, capture_output=True, text=True)
-        ok = proc.returncode == 0
-        return {"ok": ok, "stdout": proc.stdout, "stderr": proc.stderr, "returncode": proc.returncode}
-    finally:
+        if os.name == "posix":
+            subprocess.run(["rm", "-rf", path], check=False, capture_output=True)
+        elif os.name == "nt":
+            subprocess.run(["cmd", "/c", "rd", "/s", "/q", path], check=False, capture_output=True)
+    except OSError:
+        pass
+    if os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+_SANDBOX_SKIP_DIRS = (".git", "__pycache__", ".venv", "venv")
+# the agent's own state (plans, caches, vectors, source docs) sits under REPO_ROOT too; it is
+# skipped by full path, since a project may well have its own nested "data" dir
+_AGENT_DIR_PATHS = frozenset(str(Path(d).resolve()) for d in (MEMORY_DIR, CHROMA_DIR, DATA_DIR))
+_SANDBOX_NAME_IGNORE = shutil.ignore_patterns(".git", "__pycache__", ".venv*", "venv")
+
+def _sandbox_ignore(src: str, names: List[str]) -> set:
+    """One ignore callable for every copy path: the name patterns at every depth plus the agent dirs."""
+    skipped = set(_SANDBOX_NAME_IGNORE(src, names))
+    skipped.update(name for name in names if os.path.join(src, name) in _AGENT_DIR_PATHS)
+    return skipped
+
+def _copy_project(dest: str) -> None:
+    """
+    Copy REPO_ROOT's contents into the existing dir dest, skipping .git/venv/__pycache__.
+    Prefers a single native 'cp -a --reflink=auto' (copy-on-write clones where the filesystem
+    supports them, a plain copy otherwise) and prunes the skipped dirs afterwards; falls back
+    to a single shutil.copytree. Hardlinks are deliberately not used: tests that rewrite a file in
+    place would then modify the user's original.
+    """
+    names = os.listdir(REPO_ROOT)
+    skipped = _sandbox_ignore(str(REPO_ROOT), names)
+    items = [os.path.join(REPO_ROOT, name) for name in names if name not in skipped]
+    if os.name == "posix" and items and shutil.which("cp"):
+        proc = subprocess.run(["cp", "-a", "--reflink=auto", *items, dest], capture_output=True)
+        if proc.returncode == 0:
+            for root, dirs, _ in os.walk(dest):
+                for name in _sandbox_ignore(root, dirs) & set(dirs):
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                    dirs.remove(name)
+            return
+        # e.g. BSD cp without --reflink: clear any partial copy and use shutil instead
+        for child in Path(dest).iterdir():
+            if child.is_dir() and not child.is_symlink():
+                shutil.rmtree(child)
+            else:
+                child.unlink()
+    shutil.copytree(REPO_ROOT, dest, ignore=_sandbox_ignore, dirs_exist_ok=True)
+
+# Environment for every git process spawned here: no optional index lock/refresh (status-style
+# commands otherwise rewrite the index), never block on a credential prompt, and stable
+# untranslated messages.
+_GIT_ENV_OVERRIDES = {"GIT_OPTIONAL_LOCKS": "0", "GIT_TERMINAL_PROMPT": "0", "LC_ALL": "C"}
+GIT_ENV = {**os.environ, **_GIT_ENV_OVERRIDES}
+
+# Sandbox repos are scratch copies that get rebuilt rather than repaired, so their index needs
+# no trailing checksum, nothing needs fsync and auto-gc never pays off. Version 4
+# path-compresses the index.
+_SANDBOX_GIT = [
+    "git",
+    "-c", "index.skipHash=true",
+    "-c", "index.version=4",
+    "-c", "core.fsync=none",
+    "-c", "gc.auto=0",
+]
+
+TRASH_DIR = Path(tempfile.gettempdir()) / "agent_trash"
+TRASH_DIR.mkdir(parents=True, exist_ok=True)
+
+class _TrashDeleter:
+    """
+    Deletes directories on a background daemon thread so callers don't wait for teardown.
+    Paths are renamed into TRASH_DIR first (cheap, same filesystem as the temp dir), so even
+    an unfinished delete never leaves half a sandbox where the caller expects nothing.
+    Leftovers from a previous process are queued when the thread starts.
+    """
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _drain(self) -> None:
+        while True:
+            path = self._queue.get()
+            try:
+                _fast_rmtree(path)
+            except Exception:
+                pass
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                for leftover in TRASH_DIR.iterdir():
+                    self._queue.put(str(leftover))
+                self._thread = threading.Thread(target=self._drain, name="sandbox-trash", daemon=True)
+                self._thread.start()
+
+    def discard(self, path: str) -> None:
+        self._ensure_thread()
+        target = TRASH_DIR / uuid.uuid4().hex
         try:
-            tmp.unlink()
-        except Exception:
-            pass
+            os.rename(path, target)
+        except OSError:
+            # different filesystem or locked on Windows: delete in place, still off-thread
+            target = Path(path)
+        self._queue.put(str(target))
+
+_trash = _TrashDeleter()
 
-def _run_extra_commands(wd: str, commands: List[Any]) -> List[Dict[str, Any]]:
-    """Run additional validation commands inside ``wd``."""
-    results: List[Dict[str, Any]] = []
-    for entry in commands:
-        if isinstance(entry, dict):
-            name = entry.get("name") or entry.get("cmd")
-            cmd = entry.get("cmd")
-        else:
-            name = str(entry)
-            cmd = entry
-        if not cmd:
-            continue
-        if isinstance(cmd, str):
-            cmd_list = shlex.split(cmd)
-        else:
-            cmd_list = list(cmd)
-        try:
-            proc = subprocess.run(cmd_list, cwd=wd, capture_output=True, text=True)
-            results.append(
-                {
-                    "name": name,
-                    "cmd": cmd_list,
-                    "returncode": proc.returncode,
-                    "stdout": proc.stdout,
-                    "stderr": proc.stderr,
-                    "status": "passed" if proc.returncode == 0 else "failed",
-                }
-            )
-        except FileNotFoundError as exc:
-            results.append(
-                {
-                    "name": name,
-                    "cmd": cmd_list,
-                    "returncode": None,
-                    "stdout": "",
-                    "stderr": str(exc),
-                    "status": "not_found",
-                }
-            )
-        except Exception as exc:  # pragma: no cover - defensive
-            results.append(
-                {
-                    "name": name,
-                    "cmd": cmd_list,
-                    "returncode": -1,
-                    "stdout": "",
-                    "stderr": str(exc),
-                    "status": "error",
-                }
-            )
-    return results
+# The no-git sandbox (copy + git init + initial commit) is built once and reused while the
+# project is unchanged; runs are serialised on the lock since they share the directory.
+_pristine_lock = threading.Lock()
+_pristine: Optional[Tuple[float, str]] = None
+
+def _project_signature() -> float:
+    """Newest mtime under REPO_ROOT (skipping the dirs the sandbox skips, agent state included); cheap next to a copy."""
+    newest = os.path.getmtime(REPO_ROOT)
+    stack = [str(REPO_ROOT)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if (entry.name in _SANDBOX_SKIP_DIRS or entry.name.lower().startswith(".venv")
+                                or entry.path in _AGENT_DIR_PATHS):
+                            continue
+                        stack.append(entry.path)
+                    newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+                except OSError:
+                    continue
+    return newest
+
+def _build_sandbox(tmpd: str) -> None:
+    # copy project files into tmp (skip .git and venv)
+    _copy_project(tmpd)
+    # init git in tmpd
+    subprocess.run(["git", "init"], cwd=tmpd, check=True, capture_output=True, env=GIT_ENV)
+    # initial commit (identity passed inline); -f so gitignored files (.env, local config,
+    # fixtures) are tracked too and a reset between runs restores exactly this copy
+    subprocess.run([*_SANDBOX_GIT, "add", "-f", "."], cwd=tmpd, env=GIT_ENV)
+    subprocess.run(
+        [*_SANDBOX_GIT, "-c", "user.email=ai-agent@local", "-c", "user.name=ai-agent",
+         "commit", "-m", "agent: sandbox init"],
+        cwd=tmpd, capture_output=True, env=GIT_ENV,
+    )
+
+def _get_pristine_sandbox() -> str:
+    """
+    Return the cached sandbox dir, rebuilding it when the project changed since it was made.
+    Caller must hold _pristine_lock.
+    """
+    global _pristine
+    signature = _project_signature()
+    if _pristine is not None:
+        if _pristine[0] == signature and os.path.isdir(_pristine[1]):
+            return _pristine[1]
+        _trash.discard(_pristine[1])
+        _pristine = None
+    tmpd = tempfile.mkdtemp(prefix="agent_sandbox_")
+    try:
+        _build_sandbox(tmpd)
+    except Exception:
+        _trash.discard(tmpd)
+        raise
+    _pristine = (signature, tmpd)
+    return tmpd
+
+def _reset_pristine_sandbox(tmpd: str) -> None:
+    """Undo a run (patch, test artefacts); if that fails the sandbox is dropped and rebuilt next time."""
+    global _pristine
+    reset = subprocess.run([*_SANDBOX_GIT, "reset", "-q", "--hard", "HEAD"], cwd=tmpd, capture_output=True, env=GIT_ENV)
+    clean = subprocess.run([*_SANDBOX_GIT, "clean", "-q", "-fdx"], cwd=tmpd, capture_output=True, env=GIT_ENV)
+    if reset.returncode != 0 or clean.returncode != 0:
+        if _pristine is not None and _pristine[1] == tmpd:
+            _pristine = None
+        _trash.discard(tmpd)
+
+def _mirror_working_tree(wt: str) -> None:
+    """
+    Bring a fresh HEAD worktree in line with the user's checkout: tracked edits (staged or
+    not) are replayed as a binary diff, and untracked/ignored files (.env, fixtures, generated
+    files) are copied over, minus the dirs the sandbox copy skips.
+    Raises RuntimeError if the local edits cannot be replayed.
+    """
+    diff = subprocess.run(["git", "diff", "--binary", "HEAD"], cwd=REPO_ROOT, capture_output=True, env=GIT_ENV)
+    if diff.returncode != 0:
+        raise RuntimeError("git diff HEAD failed: " + diff.stderr.decode("utf-8", "replace"))
+    if diff.stdout:
+        proc = subprocess.run(["git", "apply", "--binary", "-"], cwd=wt, input=diff.stdout, capture_output=True, env=GIT_ENV)
+        if proc.returncode != 0:
+            raise RuntimeError("Could not replay uncommitted changes in the sandbox: " + proc.stderr.decode("utf-8", "replace"))
+    # --directory lists a wholly untracked dir (e.g. a venv) as one entry instead of every file in it
+    listed = subprocess.run(["git", "ls-files", "-o", "-z", "--directory"], cwd=REPO_ROOT, capture_output=True, env=GIT_ENV)
+    for rel in filter(None, listed.stdout.decode("utf-8", "surrogateescape").split("\0")):
+        rel = rel.rstrip("/")
+        src = os.path.join(REPO_ROOT, rel)
+        if any(part in _SANDBOX_SKIP_DIRS or part.lower().startswith(".venv") for part in rel.split("/")):
+            continue
+        if any(src == agent or src.startswith(agent + os.sep) for agent in _AGENT_DIR_PATHS):
+            continue
+        dst = os.path.join(wt, rel)
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.isdir(src) and not os.path.islink(src):
+                shutil.copytree(src, dst, symlinks=True, ignore=_sandbox_ignore, dirs_exist_ok=True)
+            else:
+                shutil.copy2(src, dst, follow_symlinks=False)
+        except OSError:
+            continue
+
+async def _run_extra_command_async(wd: str, entry: Any) -> Optional[Dict[str, Any]]:
+    """Run one additional validation command inside ``wd``."""
+    if isinstance(entry, dict):
+        name = entry.get("name") or entry.get("cmd")
+        cmd = entry.get("cmd")
+    else:
+        name = str(entry)
+        cmd = entry
+    if not cmd:
+        return None
+    if isinstance(cmd, str):
+        cmd_list = shlex.split(cmd)
+    else:
+        cmd_list = list(cmd)
+    try:
+        returncode, stdout, stderr = await _exec_async(cmd_list, wd)
+        return {
+            "name": name,
+            "cmd": cmd_list,
+            "returncode": returncode,
+            "stdout": stdout,
+            "stderr": stderr,
+            "status": "passed" if returncode == 0 else "failed",
+        }
+    except FileNotFoundError as exc:
+        return {
+            "name": name,
+            "cmd": cmd_list,
+            "returncode": None,
+            "stdout": "",
+            "stderr": str(exc),
+            "status": "not_found",
+        }
+    except Exception as exc:  # pragma: no cover - defensive
+        return {
+            "name": name,
+            "cmd": cmd_list,
+            "returncode": -1,
+            "stdout": "",
+            "stderr": str(exc),
+            "status": "error",
+        }
+
+
+async def _run_checks_async(
+    wd: str, timeout: int, extra_commands: Optional[List[Any]]
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Run the test command and every extra check concurrently inside ``wd``."""
+    results = await asyncio.gather(
+        run_tests_in_dir_async(wd, timeout=timeout),
+        *(_run_extra_command_async(wd, entry) for entry in extra_commands or []),
+    )
+    return results[0], [res for res in results[1:] if res is not None]
+
+
+def _run_checks(
+    wd: str, timeout: int, extra_commands: Optional[List[Any]]
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    return asyncio.run(_run_checks_async(wd, timeout, extra_commands))
 
 
 def sandbox_test_plan(plan_id: str, timeout_seconds: int = 300, extra_commands: Optional[List[Any]] = None) -> Dict[str, Any]:
     """
     Sandbox-run the plan's patch and tests.
-    If repo at REPO_ROOT is a git repo, use a new branch there and git apply (no commit), run tests, then restore.
+    If repo at REPO_ROOT is a git repo, add a detached worktree at HEAD, replay the checkout's uncommitted
+    edits and copy its untracked/ignored files into it (plans are made from the working tree), git apply
+    there (no commit), run tests, then discard it.
     If not a git repo, copy files to a temp dir, init git there, apply patch and run tests, then cleanup.
     Returns dictionary with applied flag, tests results, and errors/traces.
     """
@@ -115,7 +377,7 @@ def sandbox_test_plan(plan_id: str, timeout_seconds: int = 300, extra_commands:
     if not plan_path.exists():
         return {"plan_id": plan_id, "applied": False, "error": "Plan not found: " + str(plan_path)}
 
-    plan_obj = json.loads(plan_path.read_text(encoding="utf-8"))
+    plan_obj = orjson.loads(plan_path.read_bytes())
     patch_text = plan_obj.get("patch", "")
     if not patch_text:
         return {"plan_id": plan_id, "applied": False, "error": "Plan has no patch."}
@@ -123,97 +385,52 @@ def sandbox_test_plan(plan_id: str, timeout_seconds: int = 300, extra_commands:
     # Try to use real repo if available
     try:
         repo = Repo(REPO_ROOT)
+        repo.git.update_environment(**_GIT_ENV_OVERRIDES)
     except InvalidGitRepositoryError:
         repo = None
     except Exception as e:
         return {"plan_id": plan_id, "applied": False, "error": f"Git repo check failed: {e}", "traceback": traceback.format_exc()}
 
     if repo is not None:
-        # Repo exists: ensure clean work tree
+        # Test in a detached worktree at HEAD so the user's checkout, index and branch are
+        # never touched and several sandboxes can run at once.
+        tmpw = tempfile.mkdtemp(prefix="agent_sandbox_")
         try:
-            if repo.is_dirty(untracked_files=True):
-                return {"plan_id": plan_id, "applied": False, "error": "Repo dirty. Please commit/stash changes before sandbox testing."}
-            orig_branch = None
-            try:
-                orig_branch = repo.active_branch.name
-            except Exception:
-                orig_branch = repo.head.commit.hexsha
-            sandbox_branch = f"agent-sandbox-{plan_id}"
-            # delete if exists
-            if sandbox_branch in [h.name for h in repo.branches]:
-                repo.git.branch("-D", sandbox_branch)
-            repo.git.checkout("-b", sandbox_branch)
-            apply_res = apply_patch_text(patch_text, str(REPO_ROOT))
-            if not apply_res.get("ok"):
-                # restore branch and return error
-                try:
-                    repo.git.checkout(orig_branch)
-                    if sandbox_branch in [h.name for h in repo.branches]:
-                        repo.git.branch("-D", sandbox_branch)
-                except Exception:
-                    pass
+            repo.git.worktree("add", "--detach", tmpw, "HEAD")
+            _mirror_working_tree(tmpw)
+            apply_res = apply_patch_text(patch_text, tmpw)
+            if not apply_res.get("ok"):
                 return {"plan_id": plan_id, "applied": False, "error": "git apply failed", "apply": apply_res}
             # run tests (no commit)
-            test_res = run_tests_in_dir(str(REPO_ROOT), timeout=timeout_seconds)
-            extra_results: List[Dict[str, Any]] = []
-            if extra_commands:
-                extra_results = _run_extra_commands(str(REPO_ROOT), extra_commands)
-            # restore branch and remove sandbox branch
-            try:
-                repo.git.checkout(orig_branch)
-                if sandbox_branch in [h.name for h in repo.branches]:
-                    repo.git.branch("-D", sandbox_branch)
-            except Exception:
-                pass
-            return {"plan_id": plan_id, "applied": True, "tests": test_res, "extra_checks": extra_results}
-        except Exception as e:
-            return {"plan_id": plan_id, "applied": False, "error": str(e), "traceback": traceback.format_exc()}
-    else:
-        # No git repo — create temp copy and init new git repo there
-        tmpd = tempfile.mkdtemp(prefix="agent_sandbox_")
-        try:
-            # copy project files into tmp (skip .git and venv)
-            def _ignore(p, names):
-                ignore_list = set()
-                for n in names:
-                    ln = n.lower()
-                    if ln == ".git" or ln.startswith(".venv") or ln == "venv" or "site-packages" in ln:
-                        ignore_list.add(n)
-                return ignore_list
-            # copytree expects target not exists; using copy manually
-            for item in Path(REPO_ROOT).iterdir():
-                if item.name in (".git",) or item.name.lower().startswith(".venv") or item.name == "venv":
-                    continue
-                dest = Path(tmpd) / item.name
-                if item.is_dir():
-                    shutil.copytree(item, dest, ignore=shutil.ignore_patterns(".git", "__pycache__", ".venv", "venv"))
-                else:
-                    shutil.copy2(item, dest)
-            # init git in tmpd
-            subprocess.run(["git", "init"], cwd=tmpd, check=True, capture_output=True)
-            # configure user if needed
-            subprocess.run(["git", "config", "user.email", "ai-agent@local"], cwd=tmpd)
-            subprocess.run(["git", "config", "user.name", "ai-agent"], cwd=tmpd)
-            # initial commit
-            subprocess.run(["git", "add", "."], cwd=tmpd)
-            subprocess.run(["git", "commit", "-m", "agent: sandbox init"], cwd=tmpd, capture_output=True)
-            # apply patch
-            apply_res = apply_patch_text(patch_text, tmpd)
-            if not apply_res.get("ok"):
-                return {"plan_id": plan_id, "applied": False, "error": "git apply failed in temp repo", "apply": apply_res}
-            # run tests
-            test_res = run_tests_in_dir(tmpd, timeout=timeout_seconds)
-            extra_results: List[Dict[str, Any]] = []
-            if extra_commands:
-                extra_results = _run_extra_commands(tmpd, extra_commands)
-            return {"plan_id": plan_id, "applied": True, "tests": test_res, "extra_checks": extra_results}
+            test_res, extra_results = _run_checks(tmpw, timeout_seconds, extra_commands)
+            return {"plan_id": plan_id, "applied": True, "tests": test_res, "extra_checks": extra_results}
         except Exception as e:
             return {"plan_id": plan_id, "applied": False, "error": str(e), "traceback": traceback.format_exc()}
         finally:
+            # move the checkout to the trash and let git forget the now-missing worktree
             try:
-                shutil.rmtree(tmpd)
+                _trash.discard(tmpw)
+                repo.git.worktree("prune")
             except Exception:
                 pass
+    else:
+        # No git repo: reuse the cached git-initialised copy, reset to pristine after each run
+        with _pristine_lock:
+            tmpd = None
+            try:
+                tmpd = _get_pristine_sandbox()
+                # apply patch
+                apply_res = apply_patch_text(patch_text, tmpd)
+                if not apply_res.get("ok"):
+                    return {"plan_id": plan_id, "applied": False, "error": "git apply failed in temp repo", "apply": apply_res}
+                # run tests
+                test_res, extra_results = _run_checks(tmpd, timeout_seconds, extra_commands)
+                return {"plan_id": plan_id, "applied": True, "tests": test_res, "extra_checks": extra_results}
+            except Exception as e:
+                return {"plan_id": plan_id, "applied": False, "error": str(e), "traceback": traceback.format_exc()}
+            finally:
+                if tmpd is not None:
+                    _reset_pristine_sandbox(tmpd)
 
 
 
@@ -241,4 +458,4 @@ def get_plan(plan_id: str) -> Dict[str, Any]:
     p = Path(PLANS_DIR) / f"{plan_id}.json"
     if not p.exists():
         raise FileNotFoundError(f"Plan bulunamadı: {p}")
-    return json.loads(p.read_text(encoding="utf-8"))
+    return orjson.loads(p.read_bytes())
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-import json
 from dataclasses import dataclass
 from typing import Any, Dict, List, Tuple
 from datetime import datetime
 
+import orjson
+
 from rag_core import two_stage_retrieval, build_context_block
 from settings import LLM_MODEL
 from llm_utils import chat_once
@@ -92,15 +93,15 @@ Rules:
         if not raw_text:
             raise ValueError("Planner returned empty response")
         try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
+            return orjson.loads(raw_text)
+        except orjson.JSONDecodeError:
             # try to find JSON block inside the text
             start = raw_text.find("{")
             end = raw_text.rfind("}")
             if start == -1 or end == -1 or end <= start:
                 raise
             snippet = raw_text[start : end + 1]
-            return json.loads(snippet)
+            return orjson.loads(snippet)
 
     def create_plan(self, request_text: str) -> Dict[str, Any]:
         """Return structured plan data and provenance info."""
@@ -1,36 +1,76 @@
 # rag_core.py
-from typing import List, Dict, Optional
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Dict, Optional
 from dataclasses import dataclass
-from pathlib import Path
+import functools
+import hashlib
+import math
 import numpy as np
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Embedding / rerank modeller
-from sentence_transformers import SentenceTransformer, CrossEncoder
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+# Embedding / rerank models and the vectorstore pull in torch/transformers/chromadb, so they
+# are imported inside the functions that need them; importing rag_core stays cheap.
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 from settings import (
-    CHROMA_DIR, EMBEDDING_MODEL, TOP_K, RERANK_MODEL, USE_RERANK, MAX_TOKENS_CONTEXT
+    CHROMA_DIR, EMBEDDING_MODEL, TOP_K, RERANK_MODEL, USE_RERANK, MAX_TOKENS_CONTEXT, EMBED_BATCH_SIZE,
+    RERANK_BATCH_SIZE, USE_ONNX, ONNX_MODEL_FILE
 )
 
+# repo and symbols collections are searched side by side (Chroma releases the GIL)
+_RETRIEVAL_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval")
+
 # --- lazy singletons (thread-safe-ish) ---
 _embedder = None
 _reranker = None
+_lc_embeddings = None
+_vectorstores: Dict[str, object] = {}
 _embed_lock = threading.Lock()
 _rerank_lock = threading.Lock()
+_vs_lock = threading.Lock()
+
+def _onnx_kwargs() -> Dict:
+    """sentence-transformers kwargs selecting the int8 ONNX Runtime export, or {} if USE_ONNX is off."""
+    if not USE_ONNX:
+        return {}
+    return {"backend": "onnx", "model_kwargs": {"file_name": ONNX_MODEL_FILE}}
+
+def _load_with_onnx(factory, *args, **kwargs):
+    """
+    Build a model via factory(*args, **kwargs, **_onnx_kwargs()), falling back to the default torch
+    backend when the ONNX path is unavailable (sentence-transformers < 3.2 / 4.1 for
+    CrossEncoder, optimum/onnxruntime missing, or no such export for the model).
+    """
+    onnx = _onnx_kwargs()
+    if onnx:
+        try:
+            return factory(*args, **kwargs, **onnx)
+        except Exception as e:
+            print("ONNX backend unavailable, using torch:", e)
+    return factory(*args, **kwargs)
 
 def get_lc_embeddings():
-    return SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL, encode_kwargs={"normalize_embeddings": True})
+    global _lc_embeddings
+    with _embed_lock:
+        if _lc_embeddings is None:
+            from langchain_community.embeddings import SentenceTransformerEmbeddings
+            # same backend as get_embedder so indexed and query vectors live in one space
+            _lc_embeddings = _load_with_onnx(
+                lambda **kw: SentenceTransformerEmbeddings(
+                    model_name=EMBEDDING_MODEL, model_kwargs=kw, encode_kwargs={"normalize_embeddings": True}
+                )
+            )
+        return _lc_embeddings
 
 def get_embedder():
     global _embedder
     with _embed_lock:
         if _embedder is None:
-            _embedder = SentenceTransformer(EMBEDDING_MODEL)
+            from sentence_transformers import SentenceTransformer
+            _embedder = _load_with_onnx(SentenceTransformer, EMBEDDING_MODEL)
         return _embedder
 
 def get_reranker():
@@ -40,26 +80,95 @@ def get_reranker():
         return None
     with _rerank_lock:
         if _reranker is None:
-            _reranker = CrossEncoder(RERANK_MODEL)
+            import torch
+            from sentence_transformers import CrossEncoder
+            # fp16 halves activation memory and speeds up the forward pass on GPU;
+            # CPUs use the int8 ONNX export when USE_ONNX is set, else stay on fp32.
+            if torch.cuda.is_available():
+                _reranker = CrossEncoder(RERANK_MODEL, automodel_args={"torch_dtype": torch.float16})
+            else:
+                _reranker = _load_with_onnx(CrossEncoder, RERANK_MODEL)
         return _reranker
 
 # --- Vectorstore wrapper (Chroma via langchain-chroma) ---
 def get_vectorstore(collection_name: str = "docs"):
+    """Return the Chroma handle for collection_name, opened once per process and shared."""
     embeddings = get_lc_embeddings()
-    vs = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory=str(CHROMA_DIR),
-    )
-    return vs
+    with _vs_lock:
+        vs = _vectorstores.get(collection_name)
+        if vs is None:
+            from langchain_chroma import Chroma
+            vs = Chroma(
+                collection_name=collection_name,
+                embedding_function=embeddings,
+                persist_directory=str(CHROMA_DIR),
+            )
+            _vectorstores[collection_name] = vs
+        return vs
 
-def get_retriever(filters: Optional[Dict] = None, k: int = TOP_K, collection_name: str = "docs"):
+def collection_id(vs) -> Optional[str]:
+    """
+    Identity of the Chroma collection behind vs. It changes when the store is deleted or the
+    collection recreated, so skip state kept next to it (ingest manifests) can be checked against it.
+    """
+    cid = getattr(getattr(vs, "_collection", None), "id", None)
+    return None if cid is None else str(cid)
+
+def _build_retriever(filters: Optional[Dict], k: int, collection_name: str):
     vs = get_vectorstore(collection_name=collection_name)
     search_kwargs = {"k": k}
     if filters:
         search_kwargs["filter"] = filters
     return vs.as_retriever(search_kwargs=search_kwargs)
 
+@functools.lru_cache(maxsize=8)
+def _cached_retriever(filters_key: tuple, k: int, collection_name: str):
+    return _build_retriever(dict(filters_key), k, collection_name)
+
+def get_retriever(filters: Optional[Dict] = None, k: int = TOP_K, collection_name: str = "docs"):
+    """
+    Return a retriever for the collection, reused across calls with the same arguments;
+    all retrievers of a collection share its get_vectorstore() handle.
+    Call _cached_retriever.cache_clear() to drop them.
+    """
+    filters_key = tuple(sorted((filters or {}).items()))
+    try:
+        hash(filters_key)
+    except TypeError:
+        # nested filter values (e.g. "$and" lists) are not hashable; build uncached
+        return _build_retriever(filters, k, collection_name)
+    return _cached_retriever(filters_key, k, collection_name)
+
+class BatchedAdder:
+    """
+    Buffers add_texts() calls and forwards them to the vectorstore in batches,
+    so ingestion pays one embedding call per batch instead of one per file.
+    Call flush() once at the end; 'added' counts the chunks written so far.
+    """
+    def __init__(self, vs, batch_size: int = EMBED_BATCH_SIZE):
+        self.vs = vs
+        self.batch_size = batch_size
+        self.added = 0
+        self._texts: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._ids: List[str] = []
+
+    def add(self, texts: List[str], metadatas: List[Dict], ids: List[str]) -> None:
+        self._texts.extend(texts)
+        self._metadatas.extend(metadatas)
+        self._ids.extend(ids)
+        if len(self._texts) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._texts:
+            return
+        # swap buffers first so a failing batch is dropped rather than retried forever
+        texts, metadatas, ids = self._texts, self._metadatas, self._ids
+        self._texts, self._metadatas, self._ids = [], [], []
+        self.vs.add_texts(texts, metadatas=metadatas, ids=ids)
+        self.added += len(texts)
+
 # --- small dataclass for returned chunks ---
 @dataclass
 class RetrievedChunk:
@@ -67,25 +176,68 @@ class RetrievedChunk:
     meta: Dict
     score: Optional[float] = None
 
+_ENC = None
+_enc_lock = threading.Lock()
+
+def _get_encoder():
+    """
+    tiktoken's cl100k_base if installed (a close proxy for the local BPE models; the Ollama
+    model's own tokenizer isn't available in-process), else False.
+    """
+    global _ENC
+    with _enc_lock:
+        if _ENC is None:
+            try:
+                import tiktoken
+                _ENC = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _ENC = False
+        return _ENC
+
+@functools.lru_cache(maxsize=4096)
 def _token_estimate(s: str) -> int:
-    return max(1, len(s) // 4)
+    enc = _get_encoder()
+    if enc:
+        return max(1, len(enc.encode(s, disallowed_special=())))
+    # UTF-8 bytes/3 instead of chars/4 so CJK text and dense code aren't badly under-counted
+    return max(1, len(s.encode("utf-8", "ignore")) // 3)
+
+# running average of tokens per context block, so retrieval can size k to the context budget
+_avg_chunk_tokens: Optional[float] = None
+_AVG_CHUNK_ALPHA = 0.2
+
+def _record_chunk_tokens(tokens: int) -> None:
+    global _avg_chunk_tokens
+    prev = _avg_chunk_tokens
+    _avg_chunk_tokens = float(tokens) if prev is None else prev + _AVG_CHUNK_ALPHA * (tokens - prev)
+
+def _budget_k(default_k: int) -> int:
+    """Candidates worth fetching: no more than MAX_TOKENS_CONTEXT can hold, never below TOP_K."""
+    if not _avg_chunk_tokens:
+        return default_k
+    return max(TOP_K, min(default_k, math.ceil(MAX_TOKENS_CONTEXT / _avg_chunk_tokens)))
 
 def build_context_block(chunks: List[RetrievedChunk]) -> str:
-    acc = []
+    # header, blocks and separators go into one flat list that is joined exactly once
+    parts = ["\n--- CONTEXT ---\n"]
+    append = parts.append
     total = 0
     for c in chunks:
-        src = c.meta.get("source", c.meta.get("path", "?"))
-        ch = c.meta.get("chunk", c.meta.get("start_line", "?"))
-        header = f"[{src} :: {ch}]\n"
-        block = header + c.text.strip() + "\n"
+        meta = c.meta
+        src = meta.get("source", meta.get("path", "?"))
+        ch = meta.get("chunk", meta.get("start_line", "?"))
+        block = f"[{src} :: {ch}]\n{c.text.strip()}\n"
         t = _token_estimate(block)
+        _record_chunk_tokens(t)
         if total + t > MAX_TOKENS_CONTEXT:
             break
-        acc.append(block)
+        if total:
+            append("\n")
+        append(block)
         total += t
-    if not acc:
+    if not total:
         return ""
-    return "\n--- CONTEXT ---\n" + "\n".join(acc)
+    return "".join(parts)
 
 def to_retrieved_chunks(docs: List[Document]) -> List[RetrievedChunk]:
     out = []
@@ -93,9 +245,21 @@ def to_retrieved_chunks(docs: List[Document]) -> List[RetrievedChunk]:
         meta = d.metadata or {}
         # score might be in metadata or not; try several keys
         score = meta.get("_distance") or meta.get("score") or None
-        out.append(RetrievedChunk(text=d.page_content, meta=meta, score=score))
+        # code chunks are embedded behind a synthetic "# name (kind) in file" header; hand
+        # only the real file text on, so line numbers hold and no fake line reaches a diff
+        text = d.page_content
+        ctx_len = meta.get("ctx_len")
+        if ctx_len:
+            text = text[ctx_len:]
+        out.append(RetrievedChunk(text=text, meta=meta, score=score))
     return out
 
+
+def _content_key(text: Optional[str]) -> int:
+    """64-bit digest of a chunk's text, as an unsigned int for numpy."""
+    digest = hashlib.blake2b((text or "").encode("utf-8", "ignore"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
 # --- rerank using CrossEncoder (pairs: (query, doc_text)) ---
 def rerank_cross_encoder(query: str, docs: List[Document], top_k: int) -> List[Document]:
     """
@@ -106,10 +270,16 @@ def rerank_cross_encoder(query: str, docs: List[Document], top_k: int) -> List[D
     if rr is None or not docs:
         return docs[:top_k]
     pairs = [(query, d.page_content) for d in docs]
-    scores = rr.predict(pairs).tolist()
-    order = np.argsort(scores)[::-1]
-    ranked = [docs[i] for i in order]
-    return ranked[:top_k]
+    scores = np.asarray(rr.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False))
+    if top_k <= 0:
+        return []
+    # partial selection of the top_k, then sort just that slice
+    if top_k < len(scores):
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        idx = np.arange(len(scores))
+    idx = idx[np.argsort(-scores[idx])]
+    return [docs[i] for i in idx]
 
 # --- two-stage retrieval: repo + symbols (or any two collections) ---
 def two_stage_retrieval(query: str,
@@ -123,19 +293,29 @@ def two_stage_retrieval(query: str,
       1) retrieve repo_k docs from 'repo' collection (chunk-level),
       2) retrieve symbols_k docs from 'symbols' collection (symbol-level),
       3) combine and rerank via cross-encoder, return top_k as RetrievedChunk list.
-    Defaults: repo_k = top_k*2, symbols_k = top_k*2 if not provided.
+    Defaults: repo_k = top_k*2, symbols_k = top_k*2 if not provided, capped at the number of
+    average-sized chunks MAX_TOKENS_CONTEXT can hold once build_context_block has seen some.
     """
     if repo_k is None:
-        repo_k = max(top_k * 2, TOP_K)
+        repo_k = _budget_k(max(top_k * 2, TOP_K))
     if symbols_k is None:
-        symbols_k = max(top_k * 2, TOP_K)
+        symbols_k = _budget_k(max(top_k * 2, TOP_K))
 
     docs_combined = []
 
+    # embed the query once and search both collections with the same vector
+    # (same model + normalisation the collections were indexed with)
+    qvec = get_embedder().encode(query, normalize_embeddings=True).tolist()
+
+    def _search(collection_name: str, k: int) -> List[Document]:
+        return get_vectorstore(collection_name=collection_name).similarity_search_by_vector(qvec, k=k)
+
+    repo_future = _RETRIEVAL_POOL.submit(_search, repo_collection, repo_k)
+    sym_future = _RETRIEVAL_POOL.submit(_search, symbols_collection, symbols_k)
+
     # 1) repo retrieval
     try:
-        retr_repo = get_retriever(k=repo_k, collection_name=repo_collection)
-        docs_repo = retr_repo.get_relevant_documents(query)
+        docs_repo = repo_future.result()
         docs_combined.extend(docs_repo)
     except Exception as e:
         # fallback: empty
@@ -143,21 +323,20 @@ def two_stage_retrieval(query: str,
 
     # 2) symbols retrieval
     try:
-        retr_sym = get_retriever(k=symbols_k, collection_name=symbols_collection)
-        docs_sym = retr_sym.get_relevant_documents(query)
+        docs_sym = sym_future.result()
         docs_combined.extend(docs_sym)
     except Exception as e:
         docs_sym = []
 
-    # 3) dedupe by content (simple)
-    seen = set()
-    unique_docs = []
-    for d in docs_combined:
-        key = (d.page_content[:200].strip() if d.page_content else "") + "::" + str(d.metadata)
-        if key in seen:
-            continue
-        seen.add(key)
-        unique_docs.append(d)
+    # 3) dedupe by content: a 64-bit digest of the text is plenty to spot duplicates;
+    # np.unique hands back the first index of each digest, sorting keeps retrieval order
+    keys = np.fromiter(
+        (_content_key(d.page_content) for d in docs_combined),
+        dtype=np.uint64,
+        count=len(docs_combined),
+    )
+    _, first = np.unique(keys, return_index=True)
+    unique_docs = [docs_combined[i] for i in np.sort(first)]
 
     # 4) rerank and select top_k
     ranked = rerank_cross_encoder(query, unique_docs, top_k=top_k)
@@ -6,221 +6,268 @@ Chroma collection 'repo' içine ekler ve metadata'ları güvenli hale getirir.
 """
 from pathlib import Path
 import ast
+import functools
+import hashlib
 import os
-import json
-from typing import Iterable, List, Dict, Any, Optional
-from settings import REPO_ROOT, INCLUDE_GLOBS, EXCLUDE_GLOBS, RESPECT_GITIGNORE, CHUNK_SIZE, CHUNK_OVERLAP
+import re
+import sys
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, Dict, Any, Optional
+from settings import MEMORY_DIR, REPO_ROOT, INCLUDE_GLOBS, EXCLUDE_GLOBS, RESPECT_GITIGNORE, CHUNK_SIZE, CHUNK_OVERLAP
 from pathspec import PathSpec
 from pathspec.patterns.gitwildmatch import GitWildMatchPattern
-from rag_core import get_vectorstore
+from rag_core import get_vectorstore, BatchedAdder, collection_id
 from tqdm import tqdm
 
-# try langchain-community helper
-try:
-    from langchain_community.vectorstores.utils import filter_complex_metadata
-    _HAS_FILTER_UTIL = True
-except Exception:
-    filter_complex_metadata = None
-    _HAS_FILTER_UTIL = False
+# Safety: don't index virtualenv / site-packages (matched against directory names)
+_ADDITIONAL_EXCLUDES = frozenset({"venv", ".venv", "site-packages", "__pycache__"})
 
-# Safety: don't index virtualenv / site-packages
-_ADDITIONAL_EXCLUDES = ["\\.venv", "venv", "site-packages", ".venv", "__pycache__"]
+def compile_matcher(spec: PathSpec) -> Callable[[str], bool]:
+    """
+    OR a spec's patterns into one regex so a path costs a single match instead of
+    one per pattern. Specs with negations ("!pat") keep pathspec's last-match-wins loop.
+    """
+    pats = [p for p in spec.patterns if p.include is not None]
+    if not pats:
+        return lambda path: False
+    if not all(p.include for p in pats):
+        return spec.match_file
+    # pathspec reuses the group name "ps_d" in every pattern; drop it so they can be joined
+    rx = re.compile("|".join("(?:%s)" % p.regex.pattern.replace("(?P<ps_d>", "(?:") for p in pats))
+    return lambda path: rx.match(path) is not None
+
+# one compiled matcher per glob list instead of a tree walk (or regex) per pattern
+_INCLUDE_MATCH = compile_matcher(PathSpec.from_lines(GitWildMatchPattern, INCLUDE_GLOBS))
+_EXCLUDE_MATCH = compile_matcher(PathSpec.from_lines(GitWildMatchPattern, EXCLUDE_GLOBS))
 
 # Maximum file size to index (1 MB)
 MAX_FILE_SIZE = 1_000_000
 
+# per-file stat/hash and written ids from the last run, so unchanged files are skipped
+INGEST_MANIFEST = MEMORY_DIR / "ingest_manifest.json"
+# bump when chunk text or metadata layout changes: a manifest from another schema is dropped,
+# which re-indexes every file
+INGEST_SCHEMA = 2
+
+@functools.lru_cache(maxsize=16)
+def _load_gitignore_cached(root: str, mtime_ns: int, size: int) -> PathSpec:
+    gi = Path(root) / ".gitignore"
+    return PathSpec.from_lines(GitWildMatchPattern, gi.read_text().splitlines())
+
 def load_gitignore(root: Path) -> PathSpec:
     gi = root / ".gitignore"
-    if not gi.exists():
+    try:
+        st = gi.stat()
+    except OSError:
         return PathSpec.from_lines(GitWildMatchPattern, [])
-    return PathSpec.from_lines(GitWildMatchPattern, gi.read_text().splitlines())
+    # keyed on mtime/size so an edited .gitignore is parsed again, an unchanged one never
+    return _load_gitignore_cached(str(root), st.st_mtime_ns, st.st_size)
 
 def iter_files(root: Path) -> Iterable[Path]:
     """
     Iterate files matching INCLUDE_GLOBS, excluding EXCLUDE_GLOBS, .gitignore matches,
     and additional excludes like virtualenv or site-packages.
     """
-    spec = load_gitignore(root) if RESPECT_GITIGNORE else PathSpec.from_lines(GitWildMatchPattern, [])
-    include_set = set()
-    for pat in INCLUDE_GLOBS:
-        include_set.update(root.glob(pat))
-    ex_paths = set()
-    for pat in EXCLUDE_GLOBS:
-        ex_paths.update(root.glob(pat))
-    for p in sorted(include_set):
+    ignored = compile_matcher(load_gitignore(root)) if RESPECT_GITIGNORE else None
+    # single scandir walk; excluded directories are pruned before descending into them
+    stack = [(str(root), "")]
+    while stack:
+        path, prefix = stack.pop()
         try:
-            rel = p.relative_to(root)
-        except Exception:
-            rel = p
-        rel_str = str(rel).replace("\\", "/")
-        # skip if matches gitignore
-        if RESPECT_GITIGNORE and spec.match_file(rel_str):
-            continue
-        # skip explicit exclude globs
-        if any(str(p).replace("\\", "/").startswith(str(x).replace("\\", "/")) for x in ex_paths):
-            continue
-        # skip venv / site-packages heuristics
-        low = str(p).lower()
-        if any(ex in low for ex in _ADDITIONAL_EXCLUDES):
+            it = os.scandir(path)
+        except OSError:
             continue
-        if p.is_file() and p.stat().st_size < MAX_FILE_SIZE:
-            yield p
+        with it:
+            for entry in it:
+                rel = prefix + entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        rel_dir = rel + "/"
+                        if entry.name.lower() in _ADDITIONAL_EXCLUDES or _EXCLUDE_MATCH(rel_dir):
+                            continue
+                        if ignored is not None and ignored(rel_dir):
+                            continue
+                        stack.append((entry.path, rel_dir))
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    if not _INCLUDE_MATCH(rel) or _EXCLUDE_MATCH(rel):
+                        continue
+                    if ignored is not None and ignored(rel):
+                        continue
+                    # DirEntry caches the stat result, no second syscall per file
+                    if entry.stat(follow_symlinks=False).st_size < MAX_FILE_SIZE:
+                        yield Path(entry.path)
+                except OSError:
+                    continue
 
 # --- Helpers to extract code spans from file by lineno ---
+def get_lines_for_span_from_lines(lines: List[str], start: int, end: int) -> str:
+    start_idx = max(0, (start or 1) - 1)
+    end_idx = min(len(lines), end or len(lines))
+    return "\n".join(lines[start_idx:end_idx])
+
 def get_lines_for_span(path: Path, start: int, end: int) -> str:
     try:
-        lines = path.read_text(encoding="utf-8", errors="ignore").splitlines()
-        start_idx = max(0, (start or 1) - 1)
-        end_idx = min(len(lines), end or len(lines))
-        return "\n".join(lines[start_idx:end_idx])
+        lines = path.read_bytes().decode("utf-8", "ignore").splitlines()
+        return get_lines_for_span_from_lines(lines, start, end)
     except Exception:
         return ""
 
+def dotted_call_name(fn) -> Optional[str]:
+    """Name of a call target: "foo" or "a.b.foo"; ast.unparse only for unusual receivers."""
+    if isinstance(fn, ast.Name):
+        return fn.id
+    if not isinstance(fn, ast.Attribute):
+        return None
+    parts = []
+    node = fn
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return sys.intern(".".join(reversed(parts)))
+    try:
+        return ast.unparse(fn)
+    except Exception:
+        return getattr(fn, "attr", None)
+
+_HAS_UNPARSE = hasattr(ast, "unparse")
+
+def _decorator_name(d) -> str:
+    # "@app.get('/x')" -> "app.get": the arguments don't identify the decorator
+    if type(d) is ast.Call:
+        d = d.func
+    name = dotted_call_name(d)
+    if name:
+        return name
+    return ast.unparse(d) if _HAS_UNPARSE else ""
+
 # --- AST visitor to collect functions/classes & calls ---
-class SymbolCollector(ast.NodeVisitor):
+class SymbolCollector:
+    """
+    Iterative pre-order walk (no NodeVisitor getattr dispatch or Python recursion).
+    Every node carries the class-name prefix and the call dicts (insertion-ordered sets)
+    of the symbols that enclose it, so a Call is recorded for each enclosing symbol in the
+    same pass; calls keep first-seen order instead of being sorted per symbol.
+    """
     def __init__(self):
         self.symbols = []  # list of dicts
-        self._parent_stack = []
-
-    def visit_Module(self, node: ast.Module):
-        self._parent_stack.append("<module>")
-        self.generic_visit(node)
-        self._parent_stack.pop()
-
-    def visit_ClassDef(self, node: ast.ClassDef):
-        start = getattr(node, "lineno", None)
-        end = getattr(node, "end_lineno", None) or start
-        fullname = ".".join([*self._parent_stack, node.name]).replace("<module>.", "")
-        sym = {
-            "name": fullname,
-            "kind": "class",
-            "start_lineno": start,
-            "end_lineno": end,
-            "calls": self._collect_calls(node),
-        }
-        self.symbols.append(sym)
-        self._parent_stack.append(node.name)
-        self.generic_visit(node)
-        self._parent_stack.pop()
-
-    def visit_FunctionDef(self, node: ast.FunctionDef):
-        self._add_function(node, kind="function")
-        self.generic_visit(node)
-
-    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef):
-        self._add_function(node, kind="async_function")
-        self.generic_visit(node)
-
-    def _add_function(self, node, kind="function"):
-        start = getattr(node, "lineno", None)
-        end = getattr(node, "end_lineno", None) or start
-        # build qualified name from parent stack if possible
-        qual = ".".join([*self._parent_stack, node.name]).replace("<module>.", "")
-        sym = {
-            "name": qual,
-            "kind": kind,
-            "start_lineno": start,
-            "end_lineno": end,
-            "decorators": [ast.unparse(d) if hasattr(ast, "unparse") else "" for d in getattr(node, "decorator_list", [])],
-            "calls": self._collect_calls(node),
-        }
-        self.symbols.append(sym)
-
-    def _collect_calls(self, node):
-        calls = set()
-        class CallVisitor(ast.NodeVisitor):
-            def visit_Call(self, call_node):
-                fn = call_node.func
-                name = None
-                if isinstance(fn, ast.Name):
-                    name = fn.id
-                elif isinstance(fn, ast.Attribute):
-                    try:
-                        name = ast.unparse(fn)
-                    except Exception:
-                        name = getattr(fn, "attr", None)
+
+    def visit(self, tree: ast.AST) -> None:
+        pending = []
+        stack = [(tree, (), ())]
+        while stack:
+            node, prefix, open_calls = stack.pop()
+            t = type(node)
+            if t is ast.Call:
+                name = dotted_call_name(node.func)
                 if name:
-                    calls.add(name)
-                self.generic_visit(call_node)
-        cv = CallVisitor()
-        cv.visit(node)
-        return sorted(calls)
-
-# --- metadata sanitizer ---
-def _sanitize_metadatas(metadatas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+                    for calls in open_calls:
+                        calls[name] = None
+            elif t is ast.ClassDef or t is ast.FunctionDef or t is ast.AsyncFunctionDef:
+                start = getattr(node, "lineno", None)
+                end = getattr(node, "end_lineno", None) or start
+                sym = {
+                    "name": ".".join((*prefix, node.name)),
+                    "kind": "class" if t is ast.ClassDef else "function" if t is ast.FunctionDef else "async_function",
+                    "start_lineno": start,
+                    "end_lineno": end,
+                }
+                if t is not ast.ClassDef:
+                    sym["decorators"] = [_decorator_name(d) for d in node.decorator_list]
+                else:
+                    # only classes extend the qualified-name prefix
+                    prefix = (*prefix, node.name)
+                calls = {}
+                open_calls = (*open_calls, calls)
+                pending.append((sym, calls))
+                self.symbols.append(sym)
+            children = list(ast.iter_child_nodes(node))
+            children.reverse()
+            stack.extend((child, prefix, open_calls) for child in children)
+        for sym, calls in pending:
+            sym["calls"] = list(calls)
+
+# --- chunk metadata ---
+# Metadatas are built with a fixed, flat schema below: primitives only, with the one list
+# field ("calls") comma-joined at construction since Chroma rejects list values. That is
+# why nothing sanitizes them generically before the vectorstore. "ctx_len" is the length of
+# the contextual_text header in front of the code; retrieval strips it again so prompts
+# only ever see real file lines.
+
+# --- indexing functions ---
+def contextual_text(symbol: Optional[str], kind: Optional[str], where: str, calls: List[str], code: str) -> str:
     """
-    Use filter_complex_metadata if available; otherwise JSON-serialize complex values.
-    Ensures each metadata value is primitive or a JSON string.
+    Prefix a code span with what it is and where it lives, so the embedding carries
+    that context instead of it only sitting in metadata.
     """
-    if _HAS_FILTER_UTIL and filter_complex_metadata is not None:
-        try:
-            return filter_complex_metadata(metadatas)
-        except Exception:
-            # fallback to manual sanitation
-            pass
-
-    sanitized = []
-    for m in metadatas:
-        nm: Dict[str, Any] = {}
-        for k, v in (m or {}).items():
-            if v is None or isinstance(v, (str, int, float, bool)):
-                nm[k] = v
-            else:
-                # convert lists/dicts/other to compact JSON string
-                try:
-                    nm[k] = json.dumps(v, ensure_ascii=False)
-                except Exception:
-                    nm[k] = str(v)
-        sanitized.append(nm)
-    return sanitized
+    header = f"# {symbol} ({kind}) in {where}\n"
+    if calls:
+        header += f"# calls: {', '.join(calls[:8])}\n"
+    return header + code
 
-# --- indexing functions ---
-def index_python_file(fp: Path, vs) -> int:
+def _short_ids(metadatas: List[Dict[str, Any]], ids: List[str]) -> List[str]:
     """
-    Parse python file via AST, extract functions/classes as chunks with metadata,
-    and upsert into vectorstore.
+    Replace readable ids with fixed 16-hex-char digests; the readable form is kept
+    in each metadata dict as "long_id" for debugging.
+    """
+    out = []
+    for meta, long_id in zip(metadatas, ids):
+        meta["long_id"] = long_id
+        out.append(hashlib.blake2b(long_id.encode("utf-8", "surrogatepass"), digest_size=8).hexdigest())
+    return out
+
+def _parse_python(fp: Path):
+    """
+    Parse python file via AST and extract functions/classes as (chunks, metadatas, ids).
+    Pure CPU work with no vectorstore access, so it can run in a worker process.
     """
-    text = fp.read_text(encoding="utf-8", errors="ignore")
+    # raw bytes + decode skips TextIOWrapper's newline translation; ast.parse and
+    # splitlines() both handle "\r\n" themselves
+    text = fp.read_bytes().decode("utf-8", "ignore")
     try:
         tree = ast.parse(text)
     except Exception as e:
         # fallback: whole-file as single chunk
         meta = {"source": str(fp), "symbol": None, "kind": "file", "filename": fp.name}
-        metas = _sanitize_metadatas([meta])
-        vs.add_texts([text], metadatas=metas, ids=[f"{fp}:file"])
-        return 1
+        return [text.replace("\r\n", "\n")], [meta], _short_ids([meta], [f"{fp}:file"])
 
     collector = SymbolCollector()
     collector.visit(tree)
+    # split once; every symbol span and the fallback windows slice this list
+    lines = text.splitlines()
 
     chunks: List[str] = []
     metadatas: List[Dict[str, Any]] = []
     ids: List[str] = []
-    added = 0
 
     for sym in collector.symbols:
         start = sym.get("start_lineno") or 1
         end = sym.get("end_lineno") or start
-        code = get_lines_for_span(fp, start, end)
+        code = get_lines_for_span_from_lines(lines, start, end)
         if not code.strip():
             continue
+        calls = sym.get("calls", [])
         meta = {
             "source": str(fp),
             "symbol": sym.get("name"),
             "kind": sym.get("kind"),
             "start_line": start,
             "end_line": end,
-            "calls": sym.get("calls", []),
+            "calls": ",".join(calls),
             "filename": fp.name,
         }
-        chunks.append(code)
+        text = contextual_text(meta["symbol"], meta["kind"], fp.name, calls, code)
+        meta["ctx_len"] = len(text) - len(code)
+        chunks.append(text)
         metadatas.append(meta)
         ids.append(f"{fp}:{meta['symbol']}:{start}-{end}")
-        added += 1
 
     # if no symbols found (eg. scripts), fallback to paragraph splitting
     if not chunks:
-        lines = text.splitlines()
         window = 200
         step = 120
         idx = 0
@@ -231,53 +278,202 @@ def index_python_file(fp: Path, vs) -> int:
             metadatas.append(meta)
             ids.append(f"{fp}:chunk:{idx}")
             idx += step
-        added += len(chunks)
 
+    return chunks, metadatas, _short_ids(metadatas, ids)
+
+def _parse_one(path: str):
+    # process-pool entry point: takes/returns plain str paths and never raises
+    try:
+        return (path, *_parse_python(Path(path)), None)
+    except Exception as e:
+        return path, [], [], [], e
+
+def index_python_file(fp: Path, vs) -> int:
+    """
+    Parse python file via AST, extract functions/classes as chunks with metadata,
+    and upsert into vectorstore.
+    """
+    chunks, metadatas, ids = _parse_python(fp)
     if chunks:
-        safe_metas = _sanitize_metadatas(metadatas)
-        vs.add_texts(chunks, metadatas=safe_metas, ids=ids)
-    return added
+        vs.add_texts(chunks, metadatas=metadatas, ids=ids)
+    return len(chunks)
+
+def _split_other(fp: Path):
+    """
+    Fallback chunking for non-Python files: split by paragraphs into (chunks, metadatas, ids).
+    """
+    # paragraphs split on "\n\n", so CRLF files are normalized after the raw decode
+    text = fp.read_bytes().decode("utf-8", "ignore").replace("\r\n", "\n")
+    chunks = []
+    metas = []
+    ids = []
+    if not text.strip():
+        return chunks, metas, ids
+    paras = [p.strip() for p in text.split("\n\n") if p.strip()]
+    for i, p in enumerate(paras):
+        if len(p) < 30:
+            continue
+        meta = {"source": str(fp), "symbol": None, "kind": "other", "chunk": i, "filename": fp.name}
+        chunks.append(p)
+        metas.append(meta)
+        ids.append(f"{fp}:p{i}")
+    return chunks, metas, _short_ids(metas, ids)
 
 def index_other_file(fp: Path, vs) -> int:
     """
     Fallback indexing for non-Python files: split by paragraphs and add.
     """
     try:
-        text = fp.read_text(encoding="utf-8", errors="ignore")
-        if not text.strip():
-            return 0
-        paras = [p.strip() for p in text.split("\n\n") if p.strip()]
-        chunks = []
-        metas = []
-        ids = []
-        for i, p in enumerate(paras):
-            if len(p) < 30:
-                continue
-            meta = {"source": str(fp), "symbol": None, "kind": "other", "chunk": i, "filename": fp.name}
-            chunks.append(p)
-            metas.append(meta)
-            ids.append(f"{fp}:p{i}")
+        chunks, metas, ids = _split_other(fp)
         if chunks:
-            safe_metas = _sanitize_metadatas(metas)
-            vs.add_texts(chunks, metadatas=safe_metas, ids=ids)
+            vs.add_texts(chunks, metadatas=metas, ids=ids)
             return len(chunks)
     except Exception as e:
         print(f"[Other index error] {fp}: {e}")
     return 0
 
+# --- incremental ingest manifest ---
+def _load_manifest(collection: Optional[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Per-file skip state, or None when there is none to trust: no manifest yet (or the old
+    flat layout), another INGEST_SCHEMA, or another collection, i.e. the vector store was
+    deleted or recreated after the manifest was written.
+    """
+    try:
+        data = orjson.loads(INGEST_MANIFEST.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if not isinstance(data, dict) or data.get("schema") != INGEST_SCHEMA or data.get("collection") != collection:
+        return None
+    return data.get("files") or {}
+
+def _save_manifest(manifest: Dict[str, Dict[str, Any]], collection: Optional[str]) -> None:
+    # sibling file + rename so an interrupted run never leaves a torn manifest
+    tmp = INGEST_MANIFEST.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps({"collection": collection, "schema": INGEST_SCHEMA, "files": manifest}))
+    os.replace(tmp, INGEST_MANIFEST)
+
+def _clear_collection(vs) -> None:
+    """
+    Delete every chunk in the collection. Used when no trusted manifest says what it holds
+    (first run, chunks under the old long-id scheme, another schema), since every file is
+    re-indexed anyway and leftovers would otherwise sit next to their new copies for good.
+    """
+    try:
+        ids = vs.get(include=[])["ids"]
+        for n in range(0, len(ids), 5000):
+            vs.delete(ids=ids[n:n + 5000])
+    except Exception as e:
+        print(f"[Index error] collection reset: {e}")
+        return
+    if ids:
+        print(f"No matching ingest manifest; removed {len(ids)} previously stored chunks")
+
+def _delete_sources(vs, sources: List[str]) -> None:
+    """Delete every stored chunk of the given files, whatever ids they were written under."""
+    for n in range(0, len(sources), 500):
+        try:
+            vs.delete(where={"source": {"$in": sources[n:n + 500]}})
+        except Exception as e:
+            print(f"[Index error] chunk cleanup by source: {e}")
+
+def _changed_files(files: List[Path], manifest: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    New manifest entries for the files that need indexing. Matching mtime+size skips
+    a file outright; otherwise a content hash decides, so a bare touch is not a change.
+    """
+    changed = {}
+    for fp in files:
+        key = str(fp)
+        try:
+            st = fp.stat()
+            entry = manifest.get(key)
+            if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                continue
+            digest = hashlib.blake2b(fp.read_bytes(), digest_size=8).hexdigest()
+        except OSError:
+            continue
+        if entry and entry["hash"] == digest:
+            entry["mtime_ns"] = st.st_mtime_ns
+            continue
+        changed[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "hash": digest, "ids": []}
+    return changed
+
 def main():
     vs = get_vectorstore(collection_name="repo")
-    total = 0
-    for fp in tqdm(iter_files(REPO_ROOT), desc="Repo indexing (AST chunks)"):
+    # _parse_python/_split_other emit flat primitive metadatas, so they go to the batcher as-is
+    # chunks from many files share one embedding call per batch instead of one per file
+    batcher = BatchedAdder(vs)
+    collection = collection_id(vs)
+    manifest = _load_manifest(collection)
+    fresh = manifest is None
+    if fresh:
+        _clear_collection(vs)
+        manifest = {}
+    files = list(iter_files(REPO_ROOT))
+    live = {str(fp) for fp in files}
+    gone = [key for key in manifest if key not in live]
+    changed = _changed_files(files, manifest)
+    files = [fp for fp in files if str(fp) in changed]
+    # files without a manifest entry may still have chunks from a failed run; the manifest
+    # holds no ids for them, so clear them by source up front (a fresh start already did)
+    if not fresh:
+        _delete_sources(vs, [key for key in changed if key not in manifest])
+    ok = True
+    py_files = [str(fp) for fp in files if fp.suffix.lower() == ".py"]
+    # ast parsing holds the GIL, so it fans out to processes; Chroma writes stay in this process
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        parsed = pool.map(_parse_one, py_files, chunksize=16)
+        for fp, chunks, metadatas, ids, err in tqdm(parsed, total=len(py_files), desc="Repo indexing (AST chunks)"):
+            if err is not None:
+                print(f"[Index error] {fp}: {err}")
+                changed.pop(fp, None)
+                continue
+            changed[fp]["ids"] = ids
+            if not chunks:
+                continue
+            try:
+                batcher.add(chunks, metadatas, ids)
+            except Exception as e:
+                ok = False
+                print(f"[Index error] {fp}: {e}")
+    for fp in tqdm([fp for fp in files if fp.suffix.lower() != ".py"], desc="Repo indexing (other files)"):
         try:
-            if fp.suffix.lower() == ".py":
-                added = index_python_file(fp, vs)
-            else:
-                added = index_other_file(fp, vs)
-            total += added
+            chunks, metadatas, ids = _split_other(fp)
+            changed[str(fp)]["ids"] = ids
+            if chunks:
+                batcher.add(chunks, metadatas, ids)
         except Exception as e:
+            ok = False
+            changed.pop(str(fp), None)
             print(f"[Index error] {fp}: {e}")
-    print(f"Indexing done. Added items: {total}")
+    try:
+        batcher.flush()
+    except Exception as e:
+        ok = False
+        print(f"[Index error] {e}")
+
+    # drop chunks of deleted files, and of changed files that no longer produce them
+    for key in gone:
+        manifest.pop(key)
+    _delete_sources(vs, gone)
+    stale = []
+    if ok:
+        for key, entry in changed.items():
+            old = manifest.get(key)
+            if old:
+                stale.extend(set(old.get("ids", [])).difference(entry["ids"]))
+        manifest.update(changed)
+    else:
+        # a failed batch may have taken any file's chunks with it; re-index them next run
+        print("[Index error] some batches failed; changed files will be retried on the next run")
+    if stale:
+        try:
+            vs.delete(ids=stale)
+        except Exception as e:
+            print(f"[Index error] stale chunk cleanup: {e}")
+    _save_manifest(manifest, collection)
+    print(f"Indexing done. Added items: {batcher.added} (unchanged files skipped: {len(live) - len(files)})")
 
 if __name__ == "__main__":
     main()
@@ -7,15 +7,19 @@ Symbol index & call-graph extractor.
 - Python odaklıdır; diğer dosya türleri atlanır.
 """
 from pathlib import Path
-import json
+import orjson
 import ast
+import hashlib
+import os
+import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Any
 from tqdm import tqdm
 
 # Project helpers (kendi repo_ingest.py'de tanımlı iter_files/get_lines_for_span vs. kullanılır)
 try:
-    from repo_ingest import iter_files, get_lines_for_span
+    from repo_ingest import iter_files, get_lines_for_span_from_lines, dotted_call_name, contextual_text
 except Exception:
     # fallback: very small iter_files
     from settings import REPO_ROOT, INCLUDE_GLOBS, EXCLUDE_GLOBS, RESPECT_GITIGNORE
@@ -39,118 +43,118 @@ except Exception:
             if p.is_file():
                 yield p
 
-    def get_lines_for_span(path: Path, start: int, end: int) -> str:
+    def get_lines_for_span_from_lines(lines: List[str], start: int, end: int) -> str:
+        start_idx = max(0, (start or 1) - 1)
+        end_idx = min(len(lines), end or len(lines))
+        return "\n".join(lines[start_idx:end_idx])
+
+    def dotted_call_name(fn):
+        if isinstance(fn, ast.Name):
+            return fn.id
+        if not isinstance(fn, ast.Attribute):
+            return None
+        parts = []
+        node = fn
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if isinstance(node, ast.Name):
+            parts.append(node.id)
+            return sys.intern(".".join(reversed(parts)))
         try:
-            lines = path.read_text(encoding="utf-8", errors="ignore").splitlines()
-            start_idx = max(0, (start or 1) - 1)
-            end_idx = min(len(lines), end or len(lines))
-            return "\n".join(lines[start_idx:end_idx])
+            return ast.unparse(fn)
         except Exception:
-            return ""
+            return getattr(fn, "attr", None)
+
+    def contextual_text(symbol, kind, where, calls, code):
+        header = f"# {symbol} ({kind}) in {where}\n"
+        if calls:
+            header += f"# calls: {', '.join(calls[:8])}\n"
+        return header + code
 
 # Chroma / retrieval helper
-from rag_core import get_vectorstore
+from rag_core import get_vectorstore, BatchedAdder, collection_id
 
 MEMORY_DIR = Path("memory")
 MEMORY_DIR.mkdir(parents=True, exist_ok=True)
 SYMBOLS_JSON = MEMORY_DIR / "symbols.json"
 
+def _hashes_path(collection: str) -> Path:
+    # key -> digest of what was last embedded, per target collection
+    return MEMORY_DIR / f"symbol_hashes_{collection}.json"
+
 def _extract_symbols_from_py(fp: Path):
     """
     AST parse: returns list of symbol dicts:
     { name, kind, start_line, end_line, calls (list), docstring, code }
     """
-    text = fp.read_text(encoding="utf-8", errors="ignore")
+    text = fp.read_bytes().decode("utf-8", "ignore")
     try:
         tree = ast.parse(text)
     except Exception:
         return []
+    lines = text.splitlines()
 
     symbols = []
-    parent_stack = []
-
-    class Visitor(ast.NodeVisitor):
-        def visit_ClassDef(self, node):
-            qual = ".".join([*parent_stack, node.name]).strip(".")
+    pending = []
+    # iterative pre-order walk; each node carries its class prefix and the call dicts
+    # (first-seen-ordered sets) of every enclosing symbol, so one pass fills all of them
+    stack = [(tree, (), ())]
+    while stack:
+        node, prefix, open_calls = stack.pop()
+        t = type(node)
+        if t is ast.Call:
+            name = dotted_call_name(node.func)
+            if name:
+                for calls in open_calls:
+                    calls[name] = None
+        elif t is ast.ClassDef or t is ast.FunctionDef or t is ast.AsyncFunctionDef:
             start = getattr(node, "lineno", None)
             end = getattr(node, "end_lineno", None) or start
-            code = get_lines_for_span(fp, start or 1, end or start or 1)
-            doc = ast.get_docstring(node) or ""
-            calls = self._collect_calls(node)
-            symbols.append({
-                "name": qual,
-                "kind": "class",
+            sym = {
+                "name": ".".join((*prefix, node.name)),
+                "kind": "class" if t is ast.ClassDef else "function",
                 "path": str(fp),
                 "start_line": start,
                 "end_line": end,
-                "calls": calls,
-                "docstring": doc,
-                "code": code
-            })
-            parent_stack.append(node.name)
-            self.generic_visit(node)
-            parent_stack.pop()
-
-        def visit_FunctionDef(self, node):
-            qual = ".".join([*parent_stack, node.name]).strip(".")
-            start = getattr(node, "lineno", None)
-            end = getattr(node, "end_lineno", None) or start
-            code = get_lines_for_span(fp, start or 1, end or start or 1)
-            doc = ast.get_docstring(node) or ""
-            calls = self._collect_calls(node)
-            symbols.append({
-                "name": qual,
-                "kind": "function",
-                "path": str(fp),
-                "start_line": start,
-                "end_line": end,
-                "calls": calls,
-                "docstring": doc,
-                "code": code
-            })
-            self.generic_visit(node)
-
-        def visit_AsyncFunctionDef(self, node):
-            self.visit_FunctionDef(node)
-
-        def _collect_calls(self, node):
-            s = set()
-            class CV(ast.NodeVisitor):
-                def visit_Call(self, cnode):
-                    fn = cnode.func
-                    name = None
-                    if isinstance(fn, ast.Name):
-                        name = fn.id
-                    elif isinstance(fn, ast.Attribute):
-                        try:
-                            name = ast.unparse(fn)
-                        except Exception:
-                            name = getattr(fn, "attr", None)
-                    if name:
-                        s.add(name)
-                    self.generic_visit(cnode)
-            cv = CV()
-            cv.visit(node)
-            return sorted(s)
-
-    v = Visitor()
-    v.visit(tree)
+                "calls": None,
+                "docstring": ast.get_docstring(node) or "",
+                "code": get_lines_for_span_from_lines(lines, start or 1, end or start or 1)
+            }
+            symbols.append(sym)
+            if t is ast.ClassDef:
+                prefix = (*prefix, node.name)
+            calls = {}
+            open_calls = (*open_calls, calls)
+            pending.append((sym, calls))
+        children = list(ast.iter_child_nodes(node))
+        children.reverse()
+        stack.extend((child, prefix, open_calls) for child in children)
+    for sym, calls in pending:
+        sym["calls"] = list(calls)
     return symbols
 
+def _extract_one(path: str):
+    # process-pool entry point: plain str in, (path, symbols, error) out
+    try:
+        return path, _extract_symbols_from_py(Path(path)), None
+    except Exception as e:
+        return path, [], e
+
 def build_symbol_index(collection_to_write: str = "symbols"):
     """
     Tarama yapar, sembol datasını oluşturur, call_graph çıkarır ve memory/symbols.json'a kaydeder.
     Ayrıca Chroma 'symbols' koleksiyonuna symbol.code metinleri ile upsert yapar.
     """
     symbols_all = []  # list of dicts
-    for fp in tqdm(list(iter_files(Path("."))), desc="Symbol extraction"):
-        try:
-            if fp.suffix.lower() != ".py":
+    py_files = [str(fp) for fp in iter_files(Path(".")) if fp.suffix.lower() == ".py"]
+    # ast parsing is CPU-bound; results come back in file order
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for fp, syms, err in tqdm(pool.map(_extract_one, py_files, chunksize=16), total=len(py_files), desc="Symbol extraction"):
+            if err is not None:
+                print(f"[symbol extract error] {fp}: {err}")
                 continue
-            syms = _extract_symbols_from_py(fp)
             symbols_all.extend(syms)
-        except Exception as e:
-            print(f"[symbol extract error] {fp}: {e}")
 
     # Build lookup: name -> symbol object (last wins)
     name_to_sym: Dict[str, Dict[str, Any]] = {}
@@ -160,78 +164,89 @@ def build_symbol_index(collection_to_write: str = "symbols"):
         name_to_sym[key] = s
 
     # Build call graph (callees & callers) with best-effort name matching
-    callees_map: Dict[str, List[str]] = defaultdict(list)
-    callers_map: Dict[str, List[str]] = defaultdict(list)
+    callees_map: Dict[str, set] = defaultdict(set)
+    callers_map: Dict[str, set] = defaultdict(set)
 
-    # Create small helper to match simple names to candidates
+    # Index keys by simple name and by qualified name so each call is a dict lookup
     simple_to_keys = defaultdict(list)
+    qual_to_keys = defaultdict(list)
     for k, s in name_to_sym.items():
         simple = s["name"].split(".")[-1]
         simple_to_keys[simple].append(k)
+        qual_to_keys[s["name"]].append(k)
 
     for src_k, s in name_to_sym.items():
         for cal in s.get("calls", []):
-            # try to match cal to known symbol keys by simple name first
-            cand_keys = simple_to_keys.get(cal, [])
-            if not cand_keys:
-                # try exact match on qualified names
-                exacts = [k for k in name_to_sym.keys() if k.endswith(f"::{cal}") or k.endswith(f"::{cal}")]
-                cand_keys = exacts
+            # try to match cal to known symbol keys by simple name first,
+            # then exact match on qualified names (e.g. "Class.method")
+            cand_keys = simple_to_keys.get(cal) or qual_to_keys.get(cal, ())
             for tgt in cand_keys:
-                callees_map[src_k].append(tgt)
-                callers_map[tgt].append(src_k)
-
-    # Normalize lists (unique)
-    for k in list(callees_map.keys()):
-        callees_map[k] = sorted(list(set(callees_map[k])))
-    for k in list(callers_map.keys()):
-        callers_map[k] = sorted(list(set(callers_map[k])))
+                callees_map[src_k].add(tgt)
+                callers_map[tgt].add(src_k)
 
     # Compose output
     out = {
         "symbols": name_to_sym,     # mapping key -> symbol object
-        "callees": dict(callees_map),
-        "callers": dict(callers_map),
+        "callees": {k: sorted(v) for k, v in callees_map.items()},
+        "callers": {k: sorted(v) for k, v in callers_map.items()},
         "meta": {"count_symbols": len(name_to_sym)}
     }
 
     # save JSON
-    SYMBOLS_JSON.write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+    # orjson writes UTF-8 bytes directly; OPT_INDENT_2 keeps the file readable at C speed
+    SYMBOLS_JSON.write_bytes(orjson.dumps(out, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     print(f"Symbol index written: {SYMBOLS_JSON} (symbols: {len(name_to_sym)})")
 
-    # Also upsert to vectorstore for retrieval (one document per symbol)
+    # Also upsert to vectorstore for retrieval (one document per symbol);
+    # only symbols whose embedded text or metadata changed since the last run are re-embedded
     vs = get_vectorstore(collection_name=collection_to_write)
-    docs = []
-    metas = []
-    ids = []
+    hashes_path = _hashes_path(collection_to_write)
+    collection = collection_id(vs)
+    try:
+        stored = orjson.loads(hashes_path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        stored = {}
+    if "hashes" not in stored:
+        # older flat {key: digest} file, not tied to any collection
+        stored = {"collection": None, "hashes": stored}
+    known = stored["hashes"]
+    # digests only prove a symbol is embedded in the collection they were written for; after
+    # the store is deleted or recreated everything is embedded again
+    old_hashes = known if stored.get("collection") == collection else {}
+    if known and not old_hashes:
+        print("Symbol hashes belong to another collection; re-embedding every symbol")
+    new_hashes = {}
+    batcher = BatchedAdder(vs)
     for k, s in name_to_sym.items():
         text = s.get("docstring") or s.get("code") or ""
         if not text.strip():
             text = s.get("code")[:512] if s.get("code") else ""
+        # embed the symbol's identity along with its docstring/code
+        body = text
+        text = contextual_text(s.get("name"), s.get("kind"), s.get("path"), s.get("calls", []), body)
         meta = {
             "key": k,
             "name": s.get("name"),
             "path": s.get("path"),
-            "kind": s.get("kind")
+            "kind": s.get("kind"),
+            # header length, stripped again at retrieval (see rag_core.to_retrieved_chunks)
+            "ctx_len": len(text) - len(body),
         }
-        docs.append(text)
-        metas.append(meta)
-        ids.append(k)
-    if docs:
-        # sanitize metas similar to repo_ingest (avoid complex types)
-        safe_metas = []
-        for m in metas:
-            nm = {}
-            for a, b in m.items():
-                if b is None or isinstance(b, (str, int, float, bool)):
-                    nm[a] = b
-                else:
-                    try:
-                        nm[a] = json.dumps(b, ensure_ascii=False)
-                    except Exception:
-                        nm[a] = str(b)
-            safe_metas.append(nm)
-        vs.add_texts(docs, metadatas=safe_metas, ids=ids)
+        digest = hashlib.blake2b(orjson.dumps([text, meta]), digest_size=8).hexdigest()
+        new_hashes[k] = digest
+        if old_hashes.get(k) == digest:
+            continue
+        # every meta value above is a str or int built from the symbol dict, nothing to sanitize
+        batcher.add([text], [meta], [k])
+    batcher.flush()
+
+    stale = [k for k in known if k not in new_hashes]
+    if stale:
+        vs.delete(ids=stale)
+    tmp = hashes_path.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps({"collection": collection, "hashes": new_hashes}))
+    os.replace(tmp, hashes_path)
+    print(f"Symbols embedded: {batcher.added} (unchanged: {len(new_hashes) - batcher.added}, removed: {len(stale)})")
 
     return out
 
@@ -8,13 +8,29 @@ for _d in (DATA_DIR, CHROMA_DIR, MEMORY_DIR):
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"#"mixedbread-ai/mxbai-rerank-large-v1"
 USE_RERANK = True
+# (query, chunk) pairs scored per cross-encoder forward pass.
+RERANK_BATCH_SIZE = 64
+# Run the embedder and (CPU) reranker on ONNX Runtime with the int8 export shipped in the
+# model repos (needs sentence-transformers[onnx]); falls back to torch if unavailable.
+# Re-ingest after toggling: quantised and fp32 embeddings differ slightly.
+USE_ONNX = False
+ONNX_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
 
 CHUNK_SIZE = 900
 CHUNK_OVERLAP = 120
 TOP_K = 6
+# Context blocks from the plan's retrieval that are forwarded to the implementer prompt.
+IMPL_CONTEXT_BLOCKS = 3
+# Chunks buffered per vectorstore add_texts call (one embedding batch) during ingestion.
+EMBED_BATCH_SIZE = 256
+# PDFs with fewer pages are extracted in-process; larger ones spread pages over worker processes.
+PDF_PROCESS_MIN_PAGES = 5
 MAX_TOKENS_CONTEXT = 3000
 
 LLM_MODEL = "qwen2.5-coder:3b"
+# How long Ollama keeps the model loaded after a call, so planner and implementer
+# requests hit a warm model (and its prompt cache) instead of reloading it.
+LLM_KEEP_ALIVE = "30m"
 AGENT_MAX_STEPS = 6
 
 REPO_ROOT = Path(".").resolve()
@@ -35,6 +51,9 @@ GIT_COMMIT_MESSAGE = "feat(agent): applied changes by agent"
 
 # Test command to run after applying patches. Adjust to your project's test command if needed.
 TEST_CMD = "pytest -q"
+# Sandbox pytest runs use pytest-xdist when installed: None/True = cpu_count-2 workers,
+# an int = that many workers, False = always serial.
+TEST_PARALLEL = None
 
 # Optional static analysis commands executed during verification inside the sandbox.
 # Each entry can be either a shell string or a dict with "name" and "cmd" fields.
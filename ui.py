@@ -1,9 +1,106 @@
-# ui.py (güncellenmiş — unidiff ile hunk ayrıştırma ve esnek apply)
+# ui.py (güncellenmiş — split_patch ile tek geçişte hunk ayrıştırma ve esnek apply)
 import streamlit as st
-import requests, json
-from pathlib import Path
+import orjson
+import pandas as pd
+import requests, re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
 
 st.set_page_config(page_title="AI Dev Agent - Hunk UI", layout="wide")
+
+
+@st.cache_resource
+def _http() -> requests.Session:
+    # one keep-alive connection pool for the app; the script itself re-runs on every click
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# fail fast when the API host is down; only the read side waits for long-running steps
+CONNECT_TIMEOUT = 3.05
+
+
+def _post(url: str, payload: dict, read_timeout: float, **kwargs) -> requests.Response:
+    return _http().post(url, json=payload, timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs)
+
+
+@st.cache_resource
+def _background() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def _read_streamed(r: requests.Response, label: str) -> bytes:
+    # pull a stream=True body in chunks, showing how much has arrived so far
+    status = st.empty()
+    buf = bytearray()
+    for chunk in r.iter_content(chunk_size=64 * 1024):
+        buf += chunk
+        status.caption(f"{label}: {len(buf) // 1024} KB alındı")
+    status.empty()
+    return bytes(buf)
+
+
+def _bounded(v, maxlen: int = 500):
+    # st.json renders every node; cap each list/dict at maxlen entries and say how many were cut
+    if isinstance(v, dict):
+        out = {k: _bounded(x, maxlen) for k, x in islice(v.items(), maxlen)}
+        if len(v) > maxlen:
+            out["__truncated__"] = len(v) - maxlen
+        return out
+    if isinstance(v, list):
+        out = [_bounded(x, maxlen) for x in v[:maxlen]]
+        if len(v) > maxlen:
+            out.append({"__truncated__": len(v) - maxlen})
+        return out
+    return v
+
+
+# file name exactly as the server's parse_patch_hunks derives it: the rest of the first
+# "+++" line (stripped), else the header's fourth word; selections are keyed by it
+_TARGET_RE = re.compile(r"^\+\+\+ (.*)$", re.M)
+
+
+def _line_offsets(text: str, marker: str):
+    # offsets of every line in ``text`` that starts with ``marker``
+    offsets = [0] if text.startswith(marker) else []
+    needle = "\n" + marker
+    i = text.find(needle)
+    while i != -1:
+        offsets.append(i + 1)
+        i = text.find(needle, i + 1)
+    return offsets
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def split_patch(patch: str):
+    """
+    [{"file", "hunks"}] in one linear scan: files are sliced between "diff --git" lines and
+    hunks between "@@" lines, straight out of the patch text. Hunk indexes match the
+    server's, so selections line up. Cached per patch text, so checkbox reruns skip it.
+    """
+    files = []
+    if "\r" in patch:
+        patch = patch.replace("\r\n", "\n").replace("\r", "\n")
+    heads = _line_offsets(patch, "diff --git ")
+    for n, start in enumerate(heads):
+        block = patch[start:heads[n + 1] if n + 1 < len(heads) else len(patch)]
+        hunk_starts = _line_offsets(block, "@@")
+        m = _TARGET_RE.search(block)
+        name = m.group(1).strip() if m else ""
+        if not name:
+            header_parts = block.partition("\n")[0].split()
+            name = header_parts[3] if len(header_parts) >= 4 else ""
+        if name.startswith("b/"):
+            name = name[2:]
+        name = name or "unknown"
+        ends = hunk_starts[1:] + [len(block)]
+        files.append({"file": name, "hunks": [block[a:b] for a, b in zip(hunk_starts, ends)]})
+    return files
+
 st.title("AI Dev Agent — Patch Preview & Hunk Selection")
 
 API_URL = st.text_input("API URL", "http://localhost:8000").rstrip("/")
@@ -16,24 +113,36 @@ if "implementation" not in st.session_state:
     st.session_state.implementation = None
 if "hunks" not in st.session_state:
     st.session_state.hunks = []
-if "selections" not in st.session_state:
-    st.session_state.selections = {}
+if "hunk_previews" not in st.session_state:
+    # table rows, capped hunk texts and the hash of the patch they were built from
+    st.session_state.hunk_rows = []
+    st.session_state.hunk_previews = []
+    st.session_state.hunk_key = None
 if "verify" not in st.session_state:
     st.session_state.verify = None
+if "sandbox_prefetch" not in st.session_state:
+    st.session_state.sandbox_prefetch = None
+if "supports_hunk_apply" not in st.session_state:
+    # API_URL -> whether that server has /dev/apply/hunks (learned from the first apply)
+    st.session_state.supports_hunk_apply = {}
 
 st.header("1) Plan Oluştur")
 plan_req = st.text_area("Plan isteği", "API'ye /healthz ekle, basit JSON dönsün ve unit test yaz.")
 if st.button("Plan Oluştur"):
     try:
-        r = requests.post(f"{API_URL}/dev/plan", json={"request": plan_req}, timeout=180)
+        r = _post(f"{API_URL}/dev/plan", {"request": plan_req}, 180)
         st.write("HTTP", r.status_code)
         if r.ok:
-            payload = r.json()
+            payload = orjson.loads(r.content)
             st.session_state.last_plan = payload
             st.session_state.plan_details = payload
             st.session_state.implementation = None
             st.session_state.hunks = []
+            st.session_state.hunk_rows = []
+            st.session_state.hunk_previews = []
+            st.session_state.hunk_key = None
             st.session_state.verify = None
+            st.session_state.sandbox_prefetch = None
             st.success("Plan oluşturuldu: " + payload.get("plan_id", "?"))
 
         else:
@@ -58,12 +167,20 @@ if st.session_state.last_plan:
     st.header("2) Implementasyon")
     if st.button("Planı Uygula (Implementer)"):
         try:
-            r = requests.post(f"{API_URL}/dev/implement", json={"plan_id": plan_id}, timeout=240)
+            r = _post(f"{API_URL}/dev/implement", {"plan_id": plan_id}, 240)
             st.write("HTTP", r.status_code)
             if r.ok:
-                impl = r.json()
+                impl = orjson.loads(r.content)
                 st.session_state.implementation = impl
                 st.session_state.verify = None
+                # start the sandbox run now so its result is (nearly) ready when the button is pressed
+                st.session_state.sandbox_prefetch = (
+                    plan_id,
+                    # session resolved here: st.cache_resource needs the script thread
+                    _background().submit(
+                        _http().post, f"{API_URL}/dev/sandbox_test", json={"plan_id": plan_id}, timeout=(CONNECT_TIMEOUT, 300)
+                    ),
+                )
                 st.success("Yama üretildi.")
             else:
                 st.error(f"Implementasyon hatası: {r.status_code} -- {r.text[:2000]}")
@@ -74,53 +191,27 @@ if st.session_state.last_plan:
     if impl:
         patch_text = impl.get("patch", "")
         st.subheader("Üretilen Patch")
-        st.code(patch_text[:20000], language="diff")
-
-        # parse hunks for selection UI
-        st.session_state.hunks = []
-        if patch_text:
-            try:
-                from unidiff import PatchSet
+        if len(patch_text) <= 8000:
+            st.code(patch_text, language="diff")
+        else:
+            # bounded preview: head + tail; the full text is sent only when asked for
+            omitted = len(patch_text) - 6000
+            st.code(f"{patch_text[:4000]}\n... [{omitted} karakter gizlendi] ...\n{patch_text[-2000:]}", language="diff")
+            if st.toggle("Tam patch'i göster", key=f"{plan_id}::full_patch", value=False):
+                st.code(patch_text, language="diff")
 
-                ps = PatchSet(patch_text.splitlines(True))
-                for pf in ps:
-                    file_path = pf.path or pf.target_file or pf.source_file
-                    file_hunks = []
-                    for h in pf:
-                        try:
-                            htext = "".join(h._lines)
-                        except Exception:
-                            h_lines = []
-                            for ln in h:
-                                try:
-                                    h_lines.append(ln.value)
-                                except Exception:
-                                    h_lines.append(str(ln))
-                            htext = "\n".join(h_lines)
-                        file_hunks.append(htext)
-                    st.session_state.hunks.append({"file": file_path, "hunks": file_hunks})
-            except Exception:
-                parts = patch_text.split("\ndiff --git ")
-                for p in parts:
-                    if not p.strip():
-                        continue
-                    if not p.startswith("diff --git "):
-                        p = "diff --git " + p
-                    lines = p.splitlines()
-                    header = lines[0]
-                    fname = header.split(" b/")[-1].split()[0] if " b/" in header else header
-                    hunks = []
-                    cur = []
-                    for ln in lines:
-                        if ln.startswith("@@"):
-                            if cur:
-                                hunks.append("\n".join(cur))
-                            cur = [ln]
-                        else:
-                            cur.append(ln)
-                    if cur:
-                        hunks.append("\n".join(cur))
-                    st.session_state.hunks.append({"file": fname, "hunks": hunks})
+        # parse hunks and build the selection rows/previews once per patch; str hashes are
+        # cached on the object, so this check costs nothing while the patch is unchanged
+        if st.session_state.hunk_key != hash(patch_text):
+            hunks = split_patch(patch_text) if patch_text else []
+            st.session_state.hunks = hunks
+            st.session_state.hunk_rows = [
+                {"file": fb.get("file"), "hunk": i, "select": False, "lines": h.count("\n") + 1, "preview": h.partition("\n")[0][:200]}
+                for fb in hunks
+                for i, h in enumerate(fb.get("hunks", []))
+            ]
+            st.session_state.hunk_previews = [h[:2000] for fb in hunks for h in fb.get("hunks", [])]
+            st.session_state.hunk_key = hash(patch_text)
 
     st.markdown("----")
     # Sandbox test (tam patch)
@@ -129,67 +220,93 @@ if st.session_state.last_plan:
             st.warning("Önce plan oluştur.")
         else:
             try:
-                r = requests.post(f"{API_URL}/dev/sandbox_test", json={"plan_id": plan_id}, timeout=300)
+                prefetch = st.session_state.sandbox_prefetch
+                st.session_state.sandbox_prefetch = None
+                if prefetch and prefetch[0] == plan_id:
+                    # the background call already read its body off the UI thread
+                    r = prefetch[1].result()
+                    body = r.content
+                else:
+                    with _post(f"{API_URL}/dev/sandbox_test", {"plan_id": plan_id}, 300, stream=True) as r:
+                        body = _read_streamed(r, "Sandbox yanıtı")
                 st.write("HTTP", r.status_code)
                 try:
-                    st.json(r.json())
+                    res = orjson.loads(body)
+                    with st.expander("Sandbox sonucu", expanded=False):
+                        st.json(_bounded(res))
                 except Exception:
-                    st.text(r.text)
+                    st.text(body.decode("utf-8", "replace"))
             except Exception as e:
                 st.exception(e)
 
-    # If hunks parsed, show them and selection boxes
+    # If hunks parsed, show them in one selection table
+    edited = None
     if st.session_state.hunks:
         st.subheader("Dosya ve Hunk Seçimi")
-        selections = {}
-        for file_block in st.session_state.hunks:
-            file = file_block.get("file")
-            st.markdown(f"**{file}**")
-            hlist = file_block.get("hunks", [])
-            sel = []
-            for i, h in enumerate(hlist):
-                key = f"{plan_id}::{file}::hunk::{i}"
-                checked = st.checkbox(f"Hunk {i} (file: {file})", key=key, value=False)
-                # show a small preview of hunk
-                st.code(h[:2000], language="diff")
-                if checked:
-                    sel.append(i)
-            if sel:
-                selections[file] = sel
-        st.session_state.selections = selections
+        rows = st.session_state.hunk_rows
+        # a single data_editor widget instead of one checkbox per hunk
+        edited = st.data_editor(
+            pd.DataFrame(rows, columns=["file", "hunk", "select", "lines", "preview"]),
+            column_config={"select": st.column_config.CheckboxColumn("Seç")},
+            disabled=["file", "hunk", "lines", "preview"],
+            hide_index=True,
+            key=f"{plan_id}::hunk_select",
+        )
+        # one on-demand preview: only the chosen hunk's text is sent to the browser
+        shown = st.selectbox(
+            "Hunk önizleme",
+            [None, *range(len(rows))],
+            format_func=lambda j: "—" if j is None else f"{rows[j]['file']} · hunk {rows[j]['hunk']}",
+            key=f"{plan_id}::hunk_preview",
+        )
+        if shown is not None:
+            st.code(st.session_state.hunk_previews[shown], language="diff")
 
         st.markdown("---")
         st.caption("Seçili hunks/filenames map'i sunucuya gönderilecek. Eğer sunucu sadece file-seçimi destekliyorsa, hunk bilgisi göz ardı edilebilir.")
 
     # Apply selected hunks (try hunks endpoint first, fallback to files endpoint)
     if st.button("Seçili Hunk'leri Uygula ve Test Çalıştır"):
-        selections = st.session_state.get("selections", {})
+        # file -> hunk indexes, read off the table only when it is actually needed
+        selections = {}
+        if edited is not None:
+            for file, hunk in edited.loc[edited["select"], ["file", "hunk"]].itertuples(index=False):
+                selections.setdefault(file, []).append(int(hunk))
         if not selections:
             st.warning("Hiç hunk seçilmedi.")
         else:
-            # first try hunk-level endpoint (if server supports)
+            # first try hunk-level endpoint, unless this server is already known not to have it
             try:
-                r = requests.post(f"{API_URL}/dev/apply/hunks", json={"plan_id": plan_id, "selections": selections}, timeout=180)
-                st.write("Tried /dev/apply/hunks -> HTTP", r.status_code)
-                if r.ok:
+                r = None
+                if st.session_state.supports_hunk_apply.get(API_URL) is not False:
+                    r = _post(f"{API_URL}/dev/apply/hunks", {"plan_id": plan_id, "selections": selections}, 180)
+                    st.write("Tried /dev/apply/hunks -> HTTP", r.status_code)
+                    if r.status_code in (404, 405):
+                        st.session_state.supports_hunk_apply[API_URL] = False
+                    elif r.ok:
+                        st.session_state.supports_hunk_apply[API_URL] = True
+                if r is not None and r.ok:
                     st.success("Uygulandı (hunk-level).")
                     try:
-                        res = r.json()
-                        st.json(res)
+                        res = orjson.loads(r.content)
+                        with st.expander("Sonuç", expanded=False):
+                            st.json(_bounded(res))
                     except Exception:
                         st.text(r.text)
                 else:
                     # if not allowed or not found, fallback to files-level apply
-                    st.warning(f"/dev/apply/hunks returned {r.status_code}: {r.text[:1000]}")
+                    if r is not None:
+                        st.warning(f"/dev/apply/hunks returned {r.status_code}: {r.text[:1000]}")
                     # fallback: send files list only
                     files_only = list(selections.keys())
-                    r2 = requests.post(f"{API_URL}/dev/apply/files", json={"plan_id": plan_id, "files": files_only}, timeout=180)
+                    r2 = _post(f"{API_URL}/dev/apply/files", {"plan_id": plan_id, "files": files_only}, 180)
                     st.write("Fallback /dev/apply/files -> HTTP", r2.status_code)
                     if r2.ok:
                         st.success("Uygulandı (file-level).")
                         try:
-                            res2 = r2.json()
-                            st.json(res2)
+                            res2 = orjson.loads(r2.content)
+                            with st.expander("Sonuç", expanded=False):
+                                st.json(_bounded(res2))
                         except Exception:
                             st.text(r2.text)
                     else:
@@ -201,10 +318,10 @@ if st.session_state.last_plan:
     st.header("3) Doğrulama")
     if st.button("Planı Doğrula (auto-fix)"):
         try:
-            r = requests.post(f"{API_URL}/dev/verify", json={"plan_id": plan_id}, timeout=360)
+            r = _post(f"{API_URL}/dev/verify", {"plan_id": plan_id}, 360)
             st.write("HTTP", r.status_code)
             if r.ok:
-                st.session_state.verify = r.json()
+                st.session_state.verify = orjson.loads(r.content)
                 st.success("Doğrulama tamamlandı.")
             else:
                 st.error(f"Verify hatası: {r.status_code} -- {r.text[:2000]}")
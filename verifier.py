@@ -1,35 +1,34 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict
 
 from orchestrator import sandbox_test_plan
 from settings import STATIC_ANALYSIS_CMDS
 
+# settings are fixed for the process lifetime; sandbox_test_plan only iterates this
+_EXTRA_CMDS = tuple(cmd for cmd in (STATIC_ANALYSIS_CMDS or []) if cmd)
+
 
 class Verifier:
     """Run automated checks for a plan patch."""
 
     def run(self, plan_id: str, *, timeout_seconds: int = 300) -> Dict[str, Any]:
-        extra = [cmd for cmd in (STATIC_ANALYSIS_CMDS or []) if cmd]
-        result = sandbox_test_plan(plan_id, timeout_seconds=timeout_seconds, extra_commands=extra)
+        result = sandbox_test_plan(plan_id, timeout_seconds=timeout_seconds, extra_commands=_EXTRA_CMDS)
         tests = result.get("tests") or {}
         status = "passed" if tests.get("returncode") == 0 else "failed"
 
-        summary_parts: List[str] = []
+        checks = "; ".join(
+            f"{chk.get('name')}:{chk.get('status') or ('passed' if chk.get('returncode') == 0 else 'failed')}"
+            for chk in result.get("extra_checks") or []
+        )
         if tests:
-            rc = tests.get("returncode")
-            summary_parts.append(f"tests rc={rc}")
-        extra_checks = result.get("extra_checks") or []
-        for chk in extra_checks:
-            name = chk.get("name")
-            rc = chk.get("returncode")
-            status_str = chk.get("status") or ("passed" if rc == 0 else "failed")
-            summary_parts.append(f"{name}:{status_str}")
-
-        summary = "; ".join(summary_parts)
+            head = f"tests rc={tests.get('returncode')}"
+            summary = f"{head}; {checks}" if checks else head
+        else:
+            summary = checks
         return {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
             "status": status,
             "summary": summary,
             "details": result,